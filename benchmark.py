@@ -0,0 +1,502 @@
+# benchmark.py
+"""Mediciones de rendimiento de DigitalStock.
+
+    python benchmark.py operaciones --tamanos chico mediano --salida resultados.json
+    python benchmark.py operaciones --tamanos chico --linea-base base.json
+    python benchmark.py arranque --productos 20000 --transacciones 200000
+    python benchmark.py generar /tmp/datos --tamano mediano
+    python benchmark.py snapshot --tamano grande
+    python benchmark.py depositos --depositos 8 --productos 100000
+    python benchmark.py productos --tamano grande
+
+Los datos sintéticos son deterministas (misma semilla, mismos datos), así
+dos corridas miden exactamente lo mismo. Cada medición de arranque corre en
+un proceso nuevo (intérprete e imports en frío; la caché de páginas del
+sistema operativo sigue caliente).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional
+
+import digital_stock as ds
+
+_AQUI = os.path.dirname(os.path.abspath(__file__))
+
+# (productos, transacciones) por nivel.
+TAMANOS = {
+    "chico": (10_000, 10_000),
+    "mediano": (100_000, 100_000),
+    "grande": (1_000_000, 1_000_000),
+}
+# Primer ts del historial sintético (fijo para que los datos sean reproducibles).
+TS_INICIO = 1_700_000_000.0
+# Operaciones por medición en las funciones que escriben a disco.
+MUTACIONES_POR_MEDICION = 200
+# Diferencias menores a esto (s) no cuentan como regresión: es ruido del reloj.
+PISO_REGRESION_S = 1e-4
+
+_MARCAS = ("Acme", "Delta", "Norte", "Sur", "Andes", "Plata", "Litoral", "Pampa")
+_TIPOS = ("Tornillo", "Cable", "Tuerca", "Caño", "Llave", "Pintura", "Lija", "Cinta", "Foco", "Enchufe")
+
+
+def generar_inventario(productos: int, semilla: int = 1) -> Iterator[Dict]:
+    """Productos P000000.. con nombres, cantidades y precios pseudoaleatorios."""
+    azar = random.Random(semilla)
+    for i in range(productos):
+        producto = {"codigo": f"P{i:06d}", "nombre": f"{azar.choice(_TIPOS)} {azar.choice(_MARCAS)} {i}",
+                    "cantidad": azar.randint(0, 200), "precio": round(azar.uniform(1, 500), 2)}
+        if azar.random() < 0.1:
+            producto["umbral"] = azar.randint(0, 50)
+        yield producto
+
+
+def generar_transacciones(transacciones: int, productos: int, semilla: int = 1) -> Iterator[Dict]:
+    """Historial de COMPRA/VENTA sobre los códigos de generar_inventario, uno por minuto."""
+    azar = random.Random(semilla + 1)
+    for i in range(transacciones):
+        n = azar.randrange(productos)
+        yield ds._nueva_transaccion(azar.choice(("COMPRA", "VENTA")), f"P{n:06d}", f"Producto {n}",
+                                    azar.randint(1, 10), round(azar.uniform(1, 500), 2), ts=TS_INICIO + i * 60)
+
+
+def generar_datos(directorio: str, productos: int, transacciones: int, semilla: int = 1, lote: int = 50_000,
+                  archivar: bool = False):
+    """Inventario y balance sintéticos en <directorio> (el historial se escribe por lotes).
+
+    El historial empieza en TS_INICIO, meses antes del actual: con archivar=False
+    queda entero en el diario en lugar de pasar al archivo mientras se escribe.
+    """
+    ds.guardar_inventario(list(generar_inventario(productos, semilla)), os.path.join(directorio, ds.INVENTARIO_FILE))
+    balance = os.path.join(directorio, ds.BALANCE_FILE)
+    compresion = ds.ARCHIVO_COMPRESION
+    if not archivar:
+        ds.ARCHIVO_COMPRESION = "no"
+    try:
+        pendientes = []
+        for t in generar_transacciones(transacciones, productos, semilla):
+            pendientes.append(t)
+            if len(pendientes) >= lote:
+                ds._anexar_transacciones(pendientes, balance)
+                pendientes = []
+        ds._anexar_transacciones(pendientes, balance)
+    finally:
+        ds.ARCHIVO_COMPRESION = compresion
+
+
+def _fijar_archivado(archivar: bool):
+    """Activa o no el archivado automático en este proceso y en los que lance.
+
+    Sin archivar, balance, reportes y arranque recorren el diario entero (lo
+    que escala con el nivel); archivando, salen de los resúmenes del archivo.
+    """
+    if not archivar:
+        ds.ARCHIVO_COMPRESION = "no"
+        os.environ["DIGITALSTOCK_ARCHIVO"] = "no"
+
+
+# ---------------- Operaciones del core ----------------
+
+def _cronometrar(funcion, repeticiones: int, veces: int = 1) -> float:
+    """Mejor tiempo por llamada (s) sobre varias repeticiones de `veces` llamadas."""
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for _ in range(veces):
+            funcion()
+        mejor = min(mejor, (time.perf_counter() - inicio) / veces)
+    return mejor
+
+
+def medir_operaciones(directorio: str, productos: int, repeticiones: int = 3, semilla: int = 1) -> Dict[str, float]:
+    """Segundos por llamada de las operaciones del core sobre los datos de <directorio>."""
+    inv_file = os.path.join(directorio, ds.INVENTARIO_FILE)
+    bal_file = os.path.join(directorio, ds.BALANCE_FILE)
+    azar = random.Random(semilla + 2)
+    resultados = {"cargar_inventario": _cronometrar(lambda: ds.cargar_inventario(inv_file), repeticiones)}
+    inventario = ds.cargar_inventario(inv_file)
+
+    codigos = [f"p{azar.randrange(productos):06d}" for _ in range(10_000)]
+    resultados["buscar_producto"] = _cronometrar(lambda: [ds.buscar_producto(c, inventario) for c in codigos],
+                                                 repeticiones) / len(codigos)
+
+    resultados["indice_nombres"] = _cronometrar(lambda: ds.IndiceNombres(inventario), 1)
+    consultas = ["tornillo", "torn", "tornilo acme", "cable nrte", "pint 19", "enchufe andes 7"]
+    inventario.indice_nombres()
+    resultados["buscar_por_nombre"] = _cronometrar(lambda: [ds.buscar_por_nombre(c, inventario) for c in consultas],
+                                                   repeticiones, veces=10) / len(consultas)
+
+    # primera consulta (arma el heap) y las siguientes (ya armado)
+    resultados["bajo_stock_inicial"] = _cronometrar(lambda: ds.IndiceBajoStock(inventario).mas_urgentes(50), repeticiones)
+    resultados["obtener_productos_bajo_stock"] = _cronometrar(
+        lambda: ds.obtener_productos_bajo_stock(inventario, k=50), repeticiones, veces=100)
+
+    altas = iter(range(repeticiones * MUTACIONES_POR_MEDICION))
+    resultados["agregar_producto"] = _cronometrar(lambda: ds.agregar_producto(
+        inventario, {"codigo": f"N{next(altas):07d}", "nombre": "Nuevo", "cantidad": 1000, "precio": 1.0},
+        inventario_file=inv_file, balance_file=bal_file), repeticiones, MUTACIONES_POR_MEDICION)
+    ventas = [f"N{i:07d}" for i in range(repeticiones * MUTACIONES_POR_MEDICION)]
+    resultados["vender_producto_logico"] = _cronometrar(lambda: ds.vender_producto_logico(
+        ventas.pop(), 1, 2.0, inventario, inventario_file=inv_file, balance_file=bal_file),
+        repeticiones, MUTACIONES_POR_MEDICION)
+
+    # bajas en memoria de códigos al azar del catálogo (antes list.remove comparaba por igualdad)
+    bajas = [f"P{i:06d}" for i in azar.sample(range(productos), min(productos, repeticiones * MUTACIONES_POR_MEDICION))]
+    resultados["quitar_producto"] = _cronometrar(lambda: inventario.quitar(bajas.pop() if bajas else ""),
+                                                 repeticiones, MUTACIONES_POR_MEDICION)
+
+    def balance_en_frio():
+        for auxiliar in (bal_file + ".ckpt", bal_file + ".resumen"):
+            if os.path.exists(auxiliar):
+                os.remove(auxiliar)
+        ds.CACHE_LECTURAS.invalidar()
+        ds.calcular_balance(bal_file)
+
+    resultados["calcular_balance_frio"] = _cronometrar(balance_en_frio, repeticiones)
+    resultados["calcular_balance"] = _cronometrar(lambda: ds.calcular_balance(bal_file), repeticiones, veces=10)
+
+    def reporte_anual():
+        ds.CACHE_LECTURAS.invalidar()
+        ds.reporte_por_producto("2024-01", "2024-12", filename=bal_file)
+
+    resultados["reporte_por_producto_anual"] = _cronometrar(reporte_anual, repeticiones)
+    return resultados
+
+
+def correr(tamanos: List[str], repeticiones: int = 3, semilla: int = 1, archivar: bool = False) -> Dict:
+    """Corre las mediciones de cada nivel sobre datos nuevos en un directorio temporal."""
+    resultado = {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "semilla": semilla,
+        "archivado": archivar,
+        "tamanos": {},
+    }
+    for nombre in tamanos:
+        productos, transacciones = TAMANOS[nombre]
+        with tempfile.TemporaryDirectory() as directorio:
+            inicio = time.perf_counter()
+            generar_datos(directorio, productos, transacciones, semilla, archivar=archivar)
+            generacion = time.perf_counter() - inicio
+            resultado["tamanos"][nombre] = {
+                "productos": productos,
+                "transacciones": transacciones,
+                "generacion_s": generacion,
+                "operaciones": medir_operaciones(directorio, productos, repeticiones, semilla),
+            }
+    return resultado
+
+
+def comparar(actual: Dict, linea_base: Dict, tolerancia: float = 0.25) -> List[str]:
+    """Regresiones de `actual` contra `linea_base`: operaciones más de `tolerancia` más lentas."""
+    regresiones = []
+    for nombre, nivel in actual["tamanos"].items():
+        base = linea_base.get("tamanos", {}).get(nombre, {}).get("operaciones", {})
+        for op, segundos in nivel["operaciones"].items():
+            referencia = base.get(op)
+            if referencia is None:
+                continue
+            if segundos > referencia * (1 + tolerancia) and segundos - referencia > PISO_REGRESION_S:
+                regresiones.append(f"{nombre}/{op}: {segundos:.6f}s contra {referencia:.6f}s "
+                                   f"(+{(segundos / referencia - 1) * 100:.0f}%)")
+    return regresiones
+
+
+# ---------------- Arranque en frío ----------------
+
+# Se ejecuta en un proceso nuevo; recibe el instante de lanzamiento y si carga en segundo plano.
+_SONDA_ARRANQUE = r"""
+import json, sys, time
+t0_pared, t0 = time.time(), time.perf_counter()
+lanzado, fondo = float(sys.argv[1]), sys.argv[2] == "1"
+import digital_stock as ds
+t_import = time.perf_counter()
+sesion = ds.SesionLocal(en_segundo_plano=fondo)
+t_menu = time.perf_counter()
+sesion.inventario
+sesion.calcular_balance()
+t_datos = time.perf_counter()
+print(json.dumps({
+    "interprete_s": t0_pared - lanzado,
+    "import_s": t_import - t0,
+    "hasta_menu_s": t_menu - t0,
+    "hasta_datos_s": t_datos - t0,
+}))
+"""
+
+
+def medir_arranque(directorio: str, en_segundo_plano: bool, repeticiones: int = 5) -> Dict[str, float]:
+    """Mejor tiempo de arranque (s) sobre varias corridas en procesos nuevos."""
+    entorno = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (_AQUI, os.environ.get("PYTHONPATH")))))
+    entorno.pop("DIGITALSTOCK_BACKEND", None)
+    mejores: Dict[str, float] = {}
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, "-c", _SONDA_ARRANQUE, repr(time.time()), "1" if en_segundo_plano else "0"],
+            cwd=directorio, env=entorno, check=True, capture_output=True, text=True).stdout
+        for clave, valor in json.loads(salida).items():
+            mejores[clave] = min(valor, mejores.get(clave, valor))
+    return mejores
+
+
+# ---------------- Snapshot binario ----------------
+
+# Abre el inventario de una forma y reporta tiempos y memoria residente que suma.
+# (RSS actual de /proc: ru_maxrss se hereda del proceso padre en Linux.)
+_SONDA_SNAPSHOT = r"""
+import json, os, sys, time
+import digital_stock as ds
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+modo, archivo, codigo = sys.argv[1:4]
+rss_base = rss()
+t0 = time.perf_counter()
+if modo == "mmap":
+    snapshot = ds.SnapshotBinario(archivo)
+    t_carga = time.perf_counter()
+    snapshot.buscar(codigo)
+    t_busqueda = time.perf_counter()
+    snapshot.stock_total(), snapshot.valor_total()
+else:
+    inventario = ds.cargar_inventario(archivo)
+    t_carga = time.perf_counter()
+    ds.buscar_producto(codigo, inventario)
+    t_busqueda = time.perf_counter()
+    sum(p["cantidad"] for p in inventario), sum(p["cantidad"] * p["precio"] for p in inventario)
+t_fin = time.perf_counter()
+print(json.dumps({
+    "carga_s": t_carga - t0,
+    "busqueda_s": t_busqueda - t_carga,
+    "agregados_s": t_fin - t_busqueda,
+    "rss_extra_mb": (rss() - rss_base) / 2 ** 20,
+}))
+"""
+
+
+def medir_snapshot(directorio: str, productos: int, repeticiones: int = 3, semilla: int = 1) -> Dict:
+    """JSON contra snapshot binario (materializado y por mmap), cada corrida en un proceso nuevo."""
+    json_path = os.path.join(directorio, "inventario.json")
+    bin_path = os.path.join(directorio, "inventario.bin")
+    ds.guardar_inventario(list(generar_inventario(productos, semilla)), json_path)
+    ds.convertir_snapshot(json_path, bin_path)
+    entorno = dict(os.environ, DIGITALSTOCK_CACHE="0",
+                   PYTHONPATH=os.pathsep.join(filter(None, (_AQUI, os.environ.get("PYTHONPATH")))))
+    codigo = f"P{productos // 2:06d}"
+    resultado: Dict = {"productos": productos,
+                       "bytes": {"json": os.path.getsize(json_path), "binario": os.path.getsize(bin_path)}}
+    for modo, archivo in (("json", json_path), ("binario", bin_path), ("mmap", bin_path)):
+        mejores: Dict[str, float] = {}
+        for _ in range(repeticiones):
+            salida = subprocess.run([sys.executable, "-c", _SONDA_SNAPSHOT, modo, archivo, codigo],
+                                    cwd=directorio, env=entorno, check=True, capture_output=True, text=True).stdout
+            for clave, valor in json.loads(salida).items():
+                mejores[clave] = min(valor, mejores.get(clave, valor))
+        resultado[modo] = mejores
+    return resultado
+
+
+# ---------------- Registros de producto ----------------
+
+# Carga el mismo inventario JSON como dicts (json.load de siempre) o como
+# Producto (cargar_inventario) y reporta memoria residente que suma y tiempos
+# de las lecturas típicas sobre el catálogo.
+_SONDA_PRODUCTOS = r"""
+import json, os, sys, time
+import digital_stock as ds
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+modo, archivo = sys.argv[1:3]
+rss_base = rss()
+t0 = time.perf_counter()
+if modo == "producto":
+    inventario = ds.cargar_inventario(archivo)
+else:
+    with open(archivo, "r", encoding="utf-8") as f, ds._sin_gc():
+        inventario = ds.Inventario(json.load(f))
+t_carga = time.perf_counter()
+rss_carga = rss()
+sum(p.get("cantidad", 0) for p in inventario), sum(p["cantidad"] * p["precio"] for p in inventario)
+t_agregados = time.perf_counter()
+ds.obtener_productos_bajo_stock(inventario, k=50)
+t_bajo_stock = time.perf_counter()
+json.dumps(inventario, default=ds._a_json)
+t_fin = time.perf_counter()
+print(json.dumps({
+    "carga_s": t_carga - t0,
+    "agregados_s": t_agregados - t_carga,
+    "bajo_stock_s": t_bajo_stock - t_agregados,
+    "serializar_s": t_fin - t_bajo_stock,
+    "rss_extra_mb": (rss_carga - rss_base) / 2 ** 20,
+}))
+"""
+
+
+def medir_productos(directorio: str, productos: int, repeticiones: int = 3, semilla: int = 1, vendidos: float = 0.6) -> Dict:
+    """Memoria y tiempos del catálogo como dicts contra Producto, cada corrida en un proceso nuevo.
+
+    Una fracción `vendidos` de los productos lleva velocidad de venta
+    ("velocidad", "venta_ts"), como queda un catálogo con historial.
+    """
+    archivo = os.path.join(directorio, "inventario.json")
+    azar = random.Random(semilla + 3)
+    catalogo = list(generar_inventario(productos, semilla))
+    for p in catalogo:
+        if azar.random() < vendidos:
+            p["velocidad"] = azar.uniform(0.01, 5.0)
+            p["venta_ts"] = TS_INICIO + azar.randrange(365 * 86400)
+    ds.guardar_inventario(catalogo, archivo)
+    del catalogo
+    entorno = dict(os.environ, DIGITALSTOCK_CACHE="0",
+                   PYTHONPATH=os.pathsep.join(filter(None, (_AQUI, os.environ.get("PYTHONPATH")))))
+    resultado: Dict = {"productos": productos, "vendidos": vendidos}
+    for modo in ("dict", "producto"):
+        mejores: Dict[str, float] = {}
+        for _ in range(repeticiones):
+            salida = subprocess.run([sys.executable, "-c", _SONDA_PRODUCTOS, modo, archivo],
+                                    cwd=directorio, env=entorno, check=True, capture_output=True, text=True).stdout
+            for clave, valor in json.loads(salida).items():
+                mejores[clave] = min(valor, mejores.get(clave, valor))
+        mejores["bytes_por_producto"] = mejores["rss_extra_mb"] * 2 ** 20 / productos
+        resultado[modo] = mejores
+    return resultado
+
+
+# ---------------- Depósitos ----------------
+
+def medir_depositos(directorio: str, depositos: int, productos: int, transacciones: int, repeticiones: int = 3,
+                    archivar: bool = False) -> Dict:
+    """Consultas globales en serie (un hilo) y repartidas en procesos, más una venta en un depósito."""
+    for i in range(depositos):
+        destino = os.path.join(directorio, f"dep{i:02d}")
+        os.makedirs(destino)
+        generar_datos(destino, productos, transacciones, semilla=i + 1, archivar=archivar)
+    resultado: Dict = {"depositos": depositos, "productos_por_deposito": productos, "nucleos": os.cpu_count(),
+                       "archivado": archivar}
+    # sin caché de lecturas (los procesos trabajadores heredan el valor): cada consulta lee los shards
+    maximo, ds.CACHE_LECTURAS.maximo = ds.CACHE_LECTURAS.maximo, 0
+    ds.CACHE_LECTURAS.invalidar()
+    try:
+        for modo, paralelo, trabajadores in (("serie", "hilos", 1), ("procesos", "procesos", None)):
+            with ds.AlmacenDepositos(directorio, tipo="json", paralelo=paralelo, trabajadores=trabajadores) as almacen:
+                resultado[modo] = {
+                    "stock_total": _cronometrar(almacen.stock_total, repeticiones),
+                    "bajo_stock": _cronometrar(lambda: almacen.obtener_productos_bajo_stock(k=50), repeticiones),
+                    "resumen": _cronometrar(almacen.resumen, repeticiones),
+                }
+    finally:
+        ds.CACHE_LECTURAS.maximo = maximo
+    with ds.AlmacenDepositos(directorio, tipo="json") as almacen:
+        almacen.agregar_producto({"codigo": "N0000000", "nombre": "Nuevo", "cantidad": 10 ** 6, "precio": 1.0}, "dep00")
+        resultado["venta_en_deposito"] = _cronometrar(
+            lambda: almacen.vender("N0000000", 1, 2.0, "dep00"), repeticiones, MUTACIONES_POR_MEDICION)
+    return resultado
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks de DigitalStock.")
+    parser.add_argument("--archivar", action="store_true",
+                        help="deja activo el archivado automático de meses cerrados (por defecto se mide el diario entero)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    operaciones = sub.add_parser("operaciones", help="tiempos de las operaciones del core por nivel de tamaño")
+    operaciones.add_argument("--tamanos", nargs="+", choices=tuple(TAMANOS), default=["chico", "mediano"])
+    operaciones.add_argument("--repeticiones", type=int, default=3)
+    operaciones.add_argument("--semilla", type=int, default=1)
+    operaciones.add_argument("--salida", help="guarda los resultados en este JSON")
+    operaciones.add_argument("--linea-base", help="JSON de una corrida anterior contra el cual comparar")
+    operaciones.add_argument("--tolerancia", type=float, default=0.25,
+                             help="fracción de lentitud aceptada antes de marcar regresión")
+
+    arranque = sub.add_parser("arranque", help="tiempo de arranque en frío (proceso nuevo)")
+    arranque.add_argument("--productos", type=int, default=20000)
+    arranque.add_argument("--transacciones", type=int, default=200000)
+    arranque.add_argument("--repeticiones", type=int, default=5)
+
+    generar = sub.add_parser("generar", help="escribe un juego de datos sintético en un directorio")
+    generar.add_argument("directorio")
+    generar.add_argument("--tamano", choices=tuple(TAMANOS), default="chico")
+    generar.add_argument("--semilla", type=int, default=1)
+
+    snapshot = sub.add_parser("snapshot", help="carga y memoria: inventario JSON contra snapshot binario")
+    snapshot.add_argument("--tamano", choices=tuple(TAMANOS), default="grande")
+    snapshot.add_argument("--repeticiones", type=int, default=3)
+
+    productos = sub.add_parser("productos", help="memoria y tiempos: catálogo como dicts contra registros Producto")
+    productos.add_argument("--tamano", choices=tuple(TAMANOS), default="grande")
+    productos.add_argument("--repeticiones", type=int, default=3)
+    productos.add_argument("--vendidos", type=float, default=0.6, help="fracción de productos con velocidad de venta")
+
+    depositos = sub.add_parser("depositos", help="consultas globales sobre varios depósitos: en serie contra procesos")
+    depositos.add_argument("--depositos", type=int, default=8)
+    depositos.add_argument("--productos", type=int, default=100_000, help="por depósito")
+    depositos.add_argument("--transacciones", type=int, default=100_000, help="por depósito")
+    depositos.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args(argv)
+    _fijar_archivado(args.archivar)
+
+    if args.comando == "generar":
+        os.makedirs(args.directorio, exist_ok=True)
+        generar_datos(args.directorio, *TAMANOS[args.tamano], args.semilla, archivar=args.archivar)
+        return 0
+
+    if args.comando == "depositos":
+        with tempfile.TemporaryDirectory() as directorio:
+            resultado = medir_depositos(directorio, args.depositos, args.productos, args.transacciones, args.repeticiones,
+                                        archivar=args.archivar)
+        print(json.dumps(resultado, indent=2))
+        return 0
+
+    if args.comando == "snapshot":
+        with tempfile.TemporaryDirectory() as directorio:
+            resultado = medir_snapshot(directorio, TAMANOS[args.tamano][0], args.repeticiones)
+        print(json.dumps(resultado, indent=2))
+        return 0
+
+    if args.comando == "productos":
+        with tempfile.TemporaryDirectory() as directorio:
+            resultado = medir_productos(directorio, TAMANOS[args.tamano][0], args.repeticiones, vendidos=args.vendidos)
+        print(json.dumps(resultado, indent=2))
+        return 0
+
+    if args.comando == "arranque":
+        with tempfile.TemporaryDirectory() as directorio:
+            generar_datos(directorio, args.productos, args.transacciones, archivar=args.archivar)
+            resultado = {
+                "productos": args.productos,
+                "transacciones": args.transacciones,
+                "archivado": args.archivar,
+                "sincronico": medir_arranque(directorio, False, args.repeticiones),
+                "segundo_plano": medir_arranque(directorio, True, args.repeticiones),
+            }
+        print(json.dumps(resultado, indent=2))
+        return 0
+
+    resultado = correr(args.tamanos, args.repeticiones, args.semilla, args.archivar)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2)
+    print(json.dumps(resultado, indent=2))
+    if args.linea_base:
+        with open(args.linea_base, "r", encoding="utf-8") as f:
+            regresiones = comparar(resultado, json.load(f), args.tolerancia)
+        for r in regresiones:
+            print(f"REGRESIÓN {r}", file=sys.stderr)
+        return 1 if regresiones else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,439 @@
+# servicio.py
+"""Servicio local de stock: un único inventario en memoria para muchas cajas.
+
+Protocolo: una línea JSON por pedido {"id": n, "op": "...", "args": {...}} y
+una línea por respuesta {"id": n, "ok": true, "resultado": ...} o
+{"id": n, "ok": false, "error": "..."}. Las mutaciones que llegan dentro de
+la misma ventana de unos milisegundos se persisten juntas (commit de grupo)
+y cada cliente recibe su respuesta recién cuando su cambio está escrito.
+
+    python servicio.py --socket /tmp/digital_stock.sock
+    DIGITALSTOCK_SERVIDOR=unix:/tmp/digital_stock.sock python digital_stock.py
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import errno
+import functools
+import json
+import os
+import socket
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import digital_stock as ds
+
+# Ventana de agrupación de commits por defecto.
+ESPERA_COMMIT_MS = 2.0
+# Largo máximo de una línea de pedido (los lotes grandes superan el límite de 64 KiB de asyncio).
+MAX_PEDIDO_BYTES = 16 * 2 ** 20
+
+
+class _AlmacenDiferido:
+    """Junta cambios y transacciones en memoria hasta el próximo commit de grupo.
+
+    Implementa sólo la parte de ds.Almacenamiento que usan las mutaciones del
+    core. Guarda también los cambios compensatorios de cada operación, para
+    revertir el grupo entero si falla la escritura de sus transacciones.
+    """
+
+    def __init__(self):
+        self.cambios: List[Dict] = []
+        self.transacciones: List[Dict] = []
+        self.compensaciones: List[List[Dict]] = []  # una lista por operación, en orden
+
+    @contextmanager
+    def bloquear(self, inventario):
+        # el servicio es el único que toca el inventario en memoria (un solo hilo)
+        yield
+
+    def anexar_cambios(self, cambios: List[Dict], inventario: List[Dict]):
+        # copias: el producto puede volver a cambiar antes del commit
+        self.cambios.extend(_copiar_cambios(cambios))
+
+    def anexar_transacciones(self, transacciones: List[Dict]):
+        self.transacciones.extend(dict(t) for t in transacciones)
+
+    def anexar_lote(self, cambios: List[Dict], transacciones: List[Dict], inventario: List[Dict],
+                    compensacion: Optional[List[Dict]] = None):
+        self.anexar_cambios(cambios, inventario)
+        self.anexar_transacciones(transacciones)
+        if compensacion:
+            self.compensaciones.append(_copiar_cambios(compensacion))
+
+    def tomar(self) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+        """(cambios, transacciones, compensación) del grupo; la compensación deshace las operaciones de la última a la primera."""
+        compensacion = [c for por_operacion in reversed(self.compensaciones) for c in por_operacion]
+        cambios, transacciones = self.cambios, self.transacciones
+        self.cambios, self.transacciones, self.compensaciones = [], [], []
+        return cambios, transacciones, compensacion
+
+
+def _copiar_cambios(cambios: List[Dict]) -> List[Dict]:
+    return [dict(c, producto=dict(c["producto"])) if "producto" in c else dict(c) for c in cambios]
+
+
+class ServicioStock:
+    """Inventario autoritativo en memoria con commit de grupo sobre un Almacenamiento."""
+
+    MUTACIONES = ("agregar_producto", "vender_producto_logico", "vender_lote",
+                  "comprar_lote", "eliminar_producto_logico", "fijar_umbral")
+
+    def __init__(self, almacen: ds.Almacenamiento, espera_ms: float = ESPERA_COMMIT_MS,
+                 max_pedido_bytes: int = MAX_PEDIDO_BYTES):
+        self.almacen = almacen
+        self.max_pedido = max_pedido_bytes
+        self.inventario = almacen.cargar_inventario()
+        self.espera = espera_ms / 1000.0
+        self.metricas = {"operaciones": 0, "commits": 0, "reejecuciones": 0}
+        self._diferido = _AlmacenDiferido()
+        self._pendientes: List[Tuple[str, Dict, object, asyncio.Future]] = []
+        self._commit_programado: Optional[asyncio.TimerHandle] = None
+        self._commit_tarea: Optional[asyncio.Task] = None
+        # un commit a la vez; las mutaciones esperan a que termine el que está escribiendo
+        self._escribiendo = asyncio.Lock()
+        # la E/S (escrituras, fsync, agregados) corre fuera del hilo del loop
+        self._io = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="servicio-io")
+        # los reportes largos van en otro hilo para no demorar los commits detrás
+        self._reportes = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="servicio-reportes")
+
+    # --- operaciones ---
+
+    def _aplicar(self, op: str, args: Dict):
+        """Aplica una mutación en memoria con las funciones del core; los cambios quedan diferidos."""
+        inv, diferido = self.inventario, self._diferido
+        if op == "agregar_producto":
+            return dict(ds.agregar_producto(inv, dict(args["producto"]), almacen=diferido))
+        if op == "vender_producto_logico":
+            return ds.vender_producto_logico(args["codigo"], args["cantidad"], args["precio_unitario"], inv, almacen=diferido)
+        if op == "vender_lote":
+            return ds.vender_lote([tuple(i) for i in args["items"]], inv, almacen=diferido)
+        if op == "comprar_lote":
+            return ds.comprar_lote([dict(p) for p in args["productos"]], inv, almacen=diferido)
+        if op == "eliminar_producto_logico":
+            return dict(ds.eliminar_producto_logico(args["codigo"], inv, almacen=diferido))
+        if op == "fijar_umbral":
+            return dict(ds.fijar_umbral(args["codigo"], args.get("umbral"), inv, almacen=diferido))
+        raise ValueError(f"Operación desconocida: {op}")
+
+    async def _leer(self, op: str, args: Dict):
+        if op == "buscar_producto":
+            producto = ds.buscar_producto(args["codigo"], self.inventario)
+            return dict(producto) if producto else None
+        if op == "buscar_por_nombre":
+            return [dict(p) for p in ds.buscar_por_nombre(args["consulta"], self.inventario, args.get("k", 10))]
+        if op == "listar_inventario":
+            return [dict(p) for p in self.inventario]
+        if op == "obtener_productos_bajo_stock":
+            return [dict(p) for p in ds.obtener_productos_bajo_stock(self.inventario, k=args.get("k"))]
+        if op == "necesidad_reposicion":
+            return [dict(p) for p in ds.necesidad_reposicion(self.inventario, args.get("k"))]
+        # los agregados se leen del almacenamiento: primero se escribe lo pendiente
+        await self.commit()
+        loop = asyncio.get_running_loop()
+        if op == "calcular_balance":
+            return list(await loop.run_in_executor(self._io, self.almacen.calcular_balance))
+        if op == "desglose_mensual":
+            filas = await loop.run_in_executor(self._io, self.almacen.desglose_mensual, args.get("meses", 6))
+            return [list(f) for f in filas]
+        if op == "rentabilidad_por_producto":
+            costos = {p["codigo"]: p.get("precio", 0.0) for p in self.inventario}
+            # en serie: no se arma un pool de procesos (fork) desde adentro del servicio
+            return await loop.run_in_executor(self._reportes, functools.partial(
+                self.almacen.rentabilidad_por_producto, args.get("desde"), args.get("hasta"),
+                costos=costos, trabajadores=1))
+        raise ValueError(f"Operación desconocida: {op}")
+
+    async def ejecutar(self, op: str, args: Dict):
+        """Ejecuta un pedido; las mutaciones vuelven cuando su commit de grupo está escrito."""
+        self.metricas["operaciones"] += 1
+        if op not in self.MUTACIONES:
+            return await self._leer(op, args)
+        async with self._escribiendo:
+            resultado = self._aplicar(op, args)  # ValueError: nada quedó diferido
+            confirmado = asyncio.get_running_loop().create_future()
+            self._pendientes.append((op, args, resultado, confirmado))
+            if self._commit_programado is None:
+                self._commit_programado = asyncio.get_running_loop().call_later(self.espera, self._lanzar_commit)
+        return await confirmado
+
+    # --- commit de grupo ---
+
+    def _reejecutar(self, pendientes):
+        """Otro proceso escribió: se vuelven a aplicar los pedidos sobre el inventario recargado."""
+        self.metricas["reejecuciones"] += 1
+        self._diferido.tomar()
+        vigentes = []
+        for op, args, _, confirmado in pendientes:
+            try:
+                vigentes.append((op, args, self._aplicar(op, args), confirmado))
+            except ValueError as e:
+                confirmado.set_exception(e)
+        return vigentes
+
+    def _lanzar_commit(self):
+        self._commit_programado = None
+        self._commit_tarea = asyncio.ensure_future(self.commit())
+
+    def _escribir(self, cambios: List[Dict], transacciones: List[Dict], compensacion: List[Dict],
+                  version_previa: int) -> bool:
+        """Persiste un grupo desde el hilo de E/S; False si otro proceso escribió después de version_previa."""
+        with ds._bloqueo(self.almacen._archivo_bloqueo()):
+            if self.almacen.version() != version_previa:
+                return False
+            self.almacen.anexar_lote(cambios, transacciones, self.inventario, compensacion)
+        return True
+
+    def _recargar(self, fresco: ds.Inventario):
+        self.inventario[:] = fresco
+        self.inventario.version = fresco.version
+
+    async def commit(self):
+        """Escribe juntas todas las mutaciones pendientes y responde a sus clientes."""
+        if self._commit_programado is not None:
+            self._commit_programado.cancel()
+            self._commit_programado = None
+        async with self._escribiendo:
+            pendientes, self._pendientes = self._pendientes, []
+            if not pendientes:
+                return
+            loop = asyncio.get_running_loop()
+            error: Optional[Exception] = None
+            try:
+                while True:
+                    version_previa = self.inventario.version
+                    cambios, transacciones, compensacion = self._diferido.tomar()
+                    if await loop.run_in_executor(self._io, self._escribir, cambios, transacciones, compensacion,
+                                                  version_previa):
+                        break
+                    ds.METRICAS_CONCURRENCIA["recargas"] += 1
+                    self._recargar(await loop.run_in_executor(self._io, self.almacen.cargar_inventario))
+                    pendientes = self._reejecutar(pendientes)
+            except Exception as e:
+                # lo que está en memoria ya no coincide con el disco: se descarta
+                error = e
+                self._diferido.tomar()
+                try:
+                    self._recargar(await loop.run_in_executor(self._io, self.almacen.cargar_inventario))
+                except Exception:
+                    pass
+            finally:
+                # ningún cliente queda esperando, falle lo que falle
+                for _, _, resultado, confirmado in pendientes:
+                    if confirmado.done():
+                        continue
+                    if error is None:
+                        confirmado.set_result(resultado)
+                    else:
+                        confirmado.set_exception(error)
+            if error is None:
+                self.metricas["commits"] += 1
+
+    # --- red ---
+
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        escritura = asyncio.Lock()
+        tareas = set()
+
+        async def enviar(respuesta: Dict):
+            async with escritura:
+                writer.write(json.dumps(respuesta, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+
+        async def responder(pedido: Dict):
+            respuesta = {"id": pedido.get("id")}
+            try:
+                respuesta["resultado"] = await self.ejecutar(pedido.get("op", ""), pedido.get("args") or {})
+                respuesta["ok"] = True
+            except (ValueError, KeyError, TypeError) as e:
+                respuesta.update(ok=False, error=str(e))
+            except Exception as e:
+                respuesta.update(ok=False, error=f"Error inesperado: {e}")
+            await enviar(respuesta)
+
+        try:
+            while True:
+                linea = await _leer_linea(reader)
+                if linea is None:
+                    # sin leerlo no hay id: el error va sin id, en el orden de llegada
+                    await enviar({"id": None, "ok": False,
+                                  "error": f"Pedido demasiado grande (máximo {self.max_pedido} bytes)."})
+                    continue
+                if not linea:
+                    break
+                try:
+                    pedido = json.loads(linea)
+                except json.JSONDecodeError:
+                    continue
+                # cada pedido en su tarea: un cliente puede tener varios en vuelo
+                tarea = asyncio.create_task(responder(pedido))
+                tareas.add(tarea)
+                tarea.add_done_callback(tareas.discard)
+            if tareas:
+                await asyncio.gather(*tareas, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def servir(self, direccion: str):
+        """Atiende en "unix:/ruta" o "host:puerto" hasta que se cancele."""
+        if direccion.startswith("unix:"):
+            ruta = direccion[len("unix:"):]
+            _quitar_socket_viejo(ruta)
+            servidor = await asyncio.start_unix_server(self._atender, path=ruta, limit=self.max_pedido)
+        else:
+            host, puerto = _host_puerto(direccion)
+            servidor = await asyncio.start_server(self._atender, host, puerto, limit=self.max_pedido)
+        try:
+            async with servidor:
+                await servidor.serve_forever()
+        finally:
+            await self.commit()
+            self._io.shutdown()
+            self._reportes.shutdown()
+
+
+async def _leer_linea(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """La próxima línea del cliente (b"" al cerrar); None si supera el límite del reader.
+
+    Una línea demasiado larga se descarta entera, hasta su salto de línea,
+    para que el pedido siguiente se lea desde su comienzo.
+    """
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as e:
+        return e.partial  # sin salto de línea final: lo que quedó antes del cierre
+    except asyncio.LimitOverrunError as e:
+        excedente = e.consumed
+    try:
+        while True:
+            await reader.readexactly(excedente)
+            try:
+                await reader.readuntil(b"\n")
+                return None
+            except asyncio.LimitOverrunError as e:
+                excedente = e.consumed
+    except asyncio.IncompleteReadError:
+        return b""
+
+
+def _quitar_socket_viejo(ruta: str):
+    """Borra el socket Unix de un servicio que ya no corre; si hay uno atendiendo, falla."""
+    if not os.path.exists(ruta):
+        return
+    sonda = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sonda.connect(ruta)
+    except (ConnectionRefusedError, FileNotFoundError):
+        pass
+    except OSError as e:
+        if e.errno != errno.ENOTSOCK:
+            raise
+    else:
+        raise OSError(errno.EADDRINUSE, f"Ya hay un servicio atendiendo en {ruta}")
+    finally:
+        sonda.close()
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+def _host_puerto(direccion: str) -> Tuple[str, int]:
+    host, _, puerto = direccion.rpartition(":")
+    return host or "127.0.0.1", int(puerto)
+
+
+class ClienteStock:
+    """Cliente sincrónico del servicio, con los mismos métodos que SesionLocal."""
+
+    def __init__(self, direccion: str):
+        if direccion.startswith("unix:"):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(direccion[len("unix:"):])
+        else:
+            self._sock = socket.create_connection(_host_puerto(direccion))
+        self._archivo = self._sock.makefile("rwb")
+        self._siguiente_id = 0
+
+    def _llamar(self, op: str, **args):
+        self._siguiente_id += 1
+        pedido = {"id": self._siguiente_id, "op": op, "args": args}
+        self._archivo.write(json.dumps(pedido, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._archivo.flush()
+        linea = self._archivo.readline()
+        if not linea:
+            raise ConnectionError("El servicio cerró la conexión.")
+        respuesta = json.loads(linea)
+        if not respuesta.get("ok"):
+            raise ValueError(respuesta.get("error", "Error del servicio."))
+        return respuesta.get("resultado")
+
+    def listar_inventario(self) -> List[Dict]:
+        return ds.Inventario(self._llamar("listar_inventario"))
+
+    def buscar_producto(self, codigo: str) -> Optional[Dict]:
+        return self._llamar("buscar_producto", codigo=codigo)
+
+    def buscar_por_nombre(self, consulta: str, k: int = 10) -> List[Dict]:
+        return self._llamar("buscar_por_nombre", consulta=consulta, k=k)
+
+    def agregar_producto(self, producto: Dict) -> Dict:
+        return self._llamar("agregar_producto", producto=producto)
+
+    def vender_producto_logico(self, codigo: str, cantidad: int, precio_unitario: float):
+        self._llamar("vender_producto_logico", codigo=codigo, cantidad=cantidad, precio_unitario=precio_unitario)
+
+    def vender_lote(self, items: List[Tuple[str, int, float]]) -> List[Dict]:
+        return self._llamar("vender_lote", items=[list(i) for i in items])
+
+    def comprar_lote(self, productos: List[Dict]) -> List[Dict]:
+        return self._llamar("comprar_lote", productos=productos)
+
+    def eliminar_producto_logico(self, codigo: str) -> Dict:
+        return self._llamar("eliminar_producto_logico", codigo=codigo)
+
+    def fijar_umbral(self, codigo: str, umbral: Optional[int]) -> Dict:
+        return self._llamar("fijar_umbral", codigo=codigo, umbral=umbral)
+
+    def obtener_productos_bajo_stock(self, k: Optional[int] = None) -> List[Dict]:
+        return self._llamar("obtener_productos_bajo_stock", k=k)
+
+    def necesidad_reposicion(self, k: Optional[int] = None) -> List[Dict]:
+        return self._llamar("necesidad_reposicion", k=k)
+
+    def calcular_balance(self) -> Tuple[float, float]:
+        return tuple(self._llamar("calcular_balance"))
+
+    def desglose_mensual(self, meses: int = 6) -> List[Tuple[str, float, float]]:
+        return [tuple(f) for f in self._llamar("desglose_mensual", meses=meses)]
+
+    def rentabilidad_por_producto(self, desde: Optional[str] = None, hasta: Optional[str] = None, progreso=None) -> Dict[str, Dict]:
+        # el cálculo corre en el servicio: no hay avance intermedio
+        resultado = self._llamar("rentabilidad_por_producto", desde=desde, hasta=hasta)
+        if progreso:
+            progreso(1, 1)
+        return resultado
+
+    def cerrar(self):
+        self._archivo.close()
+        self._sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio local de DigitalStock.")
+    grupo = parser.add_mutually_exclusive_group()
+    grupo.add_argument("--socket", help="ruta del socket Unix")
+    grupo.add_argument("--puerto", type=int, help="puerto TCP en 127.0.0.1")
+    parser.add_argument("--espera-ms", type=float, default=ESPERA_COMMIT_MS,
+                        help="ventana del commit de grupo (ms)")
+    args = parser.parse_args(argv)
+    direccion = f"127.0.0.1:{args.puerto}" if args.puerto else f"unix:{args.socket or '/tmp/digital_stock.sock'}"
+    servicio = ServicioStock(ds.crear_almacenamiento(), args.espera_ms)
+    try:
+        asyncio.run(servicio.servir(direccion))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 # test_digital_stock.py
+import sqlite3
 import unittest
 import os
 import json
 import tempfile
+import glob
+import shutil
+import time
+import digital_stock
 from digital_stock import (
     cargar_inventario,
     guardar_inventario,
@@ -12,11 +17,55 @@ from digital_stock import (
     eliminar_producto_logico,
     calcular_balance,
     registrar_transaccion,
+    leer_transacciones,
+    migrar_balance_json,
+    buscar_producto_recursivo,
+    Inventario,
+    vender_lote,
+    comprar_lote,
+    AlmacenamientoJSON,
+    AlmacenamientoSQLite,
+    migrar_almacenamiento,
+    InventarioColumnar,
+    obtener_productos_bajo_stock,
+    stock_total_recursivo,
+    fijar_umbral,
+    reporte_periodo,
+    reporte_por_producto,
+    desglose_mensual,
+    METRICAS_CONCURRENCIA,
+    leer_registros,
+    importar_productos,
+    exportar_productos,
+    exportar_transacciones,
+    SnapshotBinario,
+    convertir_snapshot,
+    archivar_balance,
+    verificar_archivo,
+    AlmacenDepositos,
+    rentabilidad_por_producto,
+    necesidad_reposicion,
+    recalcular_velocidades,
+    cobertura_dias,
+    cantidad_sugerida,
+    Producto,
 )
+from servicio import ServicioStock, ClienteStock
 
-class TestDigitalStockCore(unittest.TestCase):
+class ArchivosTemporalesMixin:
+    """Inventario y balance en archivos temporales (con sus auxiliares)."""
+
+    # si no es None, ARCHIVO_COMPRESION durante el test (se restaura al terminar)
+    compresion_archivo = None
+
+    @staticmethod
+    def _ts(fecha):
+        return time.mktime(time.strptime(fecha + " 12:00", "%Y-%m-%d %H:%M"))
 
     def setUp(self):
+        self._compresion = digital_stock.ARCHIVO_COMPRESION
+        if self.compresion_archivo is not None:
+            digital_stock.ARCHIVO_COMPRESION = self.compresion_archivo
         # crear archivos temporales
         self.inv_fd, self.inv_path = tempfile.mkstemp(suffix=".json")
         os.close(self.inv_fd)
@@ -31,14 +80,20 @@ class TestDigitalStockCore(unittest.TestCase):
         guardar_inventario(self.inventario, filename=self.inv_path)
 
     def tearDown(self):
-        try:
-            os.remove(self.inv_path)
-        except OSError:
-            pass
-        try:
-            os.remove(self.bal_path)
-        except OSError:
-            pass
+        digital_stock.ARCHIVO_COMPRESION = self._compresion
+        # archivos principales y auxiliares (<archivo>.ckpt, etc.)
+        for base in (self.inv_path, self.bal_path):
+            for path in glob.glob(base + "*"):
+                try:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+
+class TestDigitalStockCore(ArchivosTemporalesMixin, unittest.TestCase):
 
     def test_cargar_guardar(self):
         inv = cargar_inventario(filename=self.inv_path)
@@ -79,5 +134,1120 @@ class TestDigitalStockCore(unittest.TestCase):
         compras, ventas = calcular_balance(filename=self.bal_path)
         self.assertEqual(compras, 100.0)
 
+    def test_diario_jsonl_una_linea_por_transaccion(self):
+        registrar_transaccion("COMPRA", "X1", "Test", 1, 100.0, filename=self.bal_path)
+        registrar_transaccion("VENTA", "X1", "Test", 1, 150.0, filename=self.bal_path)
+        with open(self.bal_path, "r", encoding="utf-8") as f:
+            lineas = [l for l in f.read().splitlines() if l]
+        self.assertEqual(len(lineas), 2)
+        self.assertEqual(json.loads(lineas[1])["tipo"], "VENTA")
+        self.assertEqual(calcular_balance(filename=self.bal_path), (100.0, 150.0))
+
+    def test_migracion_balance_legado(self):
+        legado = [
+            {"tipo": "COMPRA", "codigo": "A1", "nombre": "A", "cantidad": 2, "monto": 20.0, "ts": 1.0},
+            {"tipo": "VENTA", "codigo": "A1", "nombre": "A", "cantidad": 1, "monto": 15.0, "ts": 2.0},
+        ]
+        with open(self.bal_path, "w", encoding="utf-8") as f:
+            json.dump(legado, f, indent=2)
+        # la lectura del formato viejo es transparente
+        self.assertEqual(calcular_balance(filename=self.bal_path), (20.0, 15.0))
+        # el primer registro nuevo migra el archivo a JSONL
+        registrar_transaccion("VENTA", "A1", "A", 1, 5.0, filename=self.bal_path)
+        self.assertFalse(migrar_balance_json(self.bal_path))
+        self.assertEqual(len(list(leer_transacciones(self.bal_path))), 3)
+        self.assertEqual(calcular_balance(filename=self.bal_path), (20.0, 20.0))
+
+    def test_balance_incremental_checkpoint(self):
+        registrar_transaccion("COMPRA", "X1", "Test", 1, 100.0, filename=self.bal_path)
+        self.assertEqual(calcular_balance(filename=self.bal_path), (100.0, 0.0))
+        self.assertTrue(os.path.exists(self.bal_path + ".ckpt"))
+        registrar_transaccion("VENTA", "X1", "Test", 1, 30.0, filename=self.bal_path)
+        registrar_transaccion("VENTA", "X1", "Test", 1, 20.0, filename=self.bal_path)
+        self.assertEqual(calcular_balance(filename=self.bal_path), (100.0, 50.0))
+        with open(self.bal_path + ".ckpt", "r", encoding="utf-8") as f:
+            ckpt = json.load(f)
+        self.assertEqual(ckpt["offset"], os.path.getsize(self.bal_path))
+
+    def test_balance_checkpoint_obsoleto_recalcula(self):
+        registrar_transaccion("VENTA", "X1", "Test", 1, 30.0, filename=self.bal_path)
+        calcular_balance(filename=self.bal_path)
+        # el diario se reescribe por fuera: el checkpoint ya no corresponde
+        with open(self.bal_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"tipo": "COMPRA", "monto": 7.0}) + "\n")
+        self.assertEqual(calcular_balance(filename=self.bal_path), (7.0, 0.0))
+
+class TestLogCambiosInventario(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def test_venta_no_reescribe_snapshot(self):
+        with open(self.inv_path, "rb") as f:
+            snapshot = f.read()
+        inv = cargar_inventario(filename=self.inv_path)
+        vender_producto_logico("A1", 2, 12.0, inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        with open(self.inv_path, "rb") as f:
+            self.assertEqual(f.read(), snapshot)
+        self.assertTrue(os.path.exists(self.inv_path + ".log"))
+        self.assertEqual(buscar_producto("A1", cargar_inventario(filename=self.inv_path))["cantidad"], 3)
+
+    def test_log_se_aplica_en_orden(self):
+        inv = cargar_inventario(filename=self.inv_path)
+        agregar_producto(inv, {"codigo": "C3", "nombre": "C", "cantidad": 4, "precio": 1.0},
+                         inventario_file=self.inv_path, balance_file=self.bal_path)
+        agregar_producto(inv, {"codigo": "D4", "nombre": "D", "cantidad": 2, "precio": 1.0},
+                         inventario_file=self.inv_path, balance_file=self.bal_path)
+        vender_producto_logico("C3", 1, 2.0, inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        eliminar_producto_logico("A1", inv, inventario_file=self.inv_path)
+        esperado = [("B2", 20), ("C3", 3), ("D4", 2)]
+        self.assertEqual([(p["codigo"], p["cantidad"]) for p in inv], esperado)
+        inv2 = cargar_inventario(filename=self.inv_path)
+        self.assertEqual([(p["codigo"], p["cantidad"]) for p in inv2], esperado)
+
+    def test_compactacion_por_umbral(self):
+        anterior = digital_stock.COMPACTAR_MIN_BYTES
+        digital_stock.COMPACTAR_MIN_BYTES = 0
+        try:
+            inv = cargar_inventario(filename=self.inv_path)
+            for _ in range(5):
+                vender_producto_logico("B2", 1, 6.0, inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        finally:
+            digital_stock.COMPACTAR_MIN_BYTES = anterior
+        with open(self.inv_path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        log = self.inv_path + ".log"
+        pendientes = open(log).read().splitlines() if os.path.exists(log) else []
+        self.assertLess(len(pendientes), 5)
+        self.assertEqual(buscar_producto("B2", cargar_inventario(filename=self.inv_path))["cantidad"], 15)
+        self.assertLess(buscar_producto("B2", snapshot)["cantidad"], 20)
+
+    def test_falla_al_compactar_no_falla_la_venta(self):
+        anterior, guardar = digital_stock.COMPACTAR_MIN_BYTES, digital_stock.guardar_inventario
+        def falla(*args, **kwargs):
+            raise OSError("disco lleno")
+        digital_stock.COMPACTAR_MIN_BYTES, digital_stock.guardar_inventario = 0, falla
+        try:
+            inv = cargar_inventario(filename=self.inv_path)
+            vender_producto_logico("B2", 1, 6.0, inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+            vender_lote([("A1", 2, 12.0)], inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        finally:
+            digital_stock.COMPACTAR_MIN_BYTES, digital_stock.guardar_inventario = anterior, guardar
+        recargado = cargar_inventario(filename=self.inv_path)
+        self.assertEqual((recargado.buscar("B2")["cantidad"], recargado.buscar("A1")["cantidad"]), (19, 3))
+        self.assertEqual([t["tipo"] for t in leer_transacciones(self.bal_path)], ["VENTA", "VENTA"])
+
+
+class TestLotes(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def test_vender_lote(self):
+        inv = cargar_inventario(filename=self.inv_path)
+        trans = vender_lote([("A1", 2, 12.0), ("b2", 5, 6.0), ("A1", 1, 12.0)], inv,
+                            inventario_file=self.inv_path, balance_file=self.bal_path)
+        self.assertEqual(len(trans), 3)
+        inv2 = cargar_inventario(filename=self.inv_path)
+        self.assertEqual(buscar_producto("A1", inv2)["cantidad"], 2)
+        self.assertEqual(buscar_producto("B2", inv2)["cantidad"], 15)
+        self.assertEqual(calcular_balance(filename=self.bal_path), (0.0, 66.0))
+
+    def test_vender_lote_rollback_si_falta_stock(self):
+        inv = cargar_inventario(filename=self.inv_path)
+        # A1 tiene 5: las dos líneas juntas superan el stock
+        with self.assertRaises(ValueError):
+            vender_lote([("B2", 1, 6.0), ("A1", 3, 12.0), ("A1", 3, 12.0)], inv,
+                        inventario_file=self.inv_path, balance_file=self.bal_path)
+        self.assertEqual([p["cantidad"] for p in inv], [5, 20])
+        self.assertEqual([p["cantidad"] for p in cargar_inventario(filename=self.inv_path)], [5, 20])
+        self.assertEqual(calcular_balance(filename=self.bal_path), (0.0, 0.0))
+
+    def test_vender_lote_rollback_si_falla_la_escritura(self):
+        inv = cargar_inventario(filename=self.inv_path)
+        directorio = tempfile.mkdtemp()
+        try:
+            with self.assertRaises(OSError):
+                vender_lote([("A1", 1, 12.0)], inv, inventario_file=self.inv_path, balance_file=directorio)
+        finally:
+            os.rmdir(directorio)
+            os.remove(directorio + ".lock")
+        self.assertEqual(buscar_producto("A1", inv)["cantidad"], 5)
+        self.assertEqual(buscar_producto("A1", cargar_inventario(filename=self.inv_path))["cantidad"], 5)
+
+    def test_comprar_lote_y_duplicados(self):
+        inv = cargar_inventario(filename=self.inv_path)
+        nuevos = [{"codigo": "C3", "nombre": "C", "cantidad": 2, "precio": 1.5},
+                  {"codigo": "D4", "nombre": "D", "cantidad": 1, "precio": 4.0}]
+        comprar_lote(nuevos, inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        self.assertEqual(len(cargar_inventario(filename=self.inv_path)), 4)
+        self.assertEqual(calcular_balance(filename=self.bal_path), (7.0, 0.0))
+        with self.assertRaises(ValueError):
+            comprar_lote([{"codigo": "E5", "nombre": "E", "cantidad": 1, "precio": 1.0},
+                          {"codigo": "e5", "nombre": "E", "cantidad": 1, "precio": 1.0}], inv,
+                         inventario_file=self.inv_path, balance_file=self.bal_path)
+        self.assertIsNone(buscar_producto("E5", inv))
+
+
+class TestAlmacenamientoSQLite(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.db_path = self.inv_path + ".db"
+        self.almacen = AlmacenamientoSQLite(self.db_path)
+        self.almacen.guardar_inventario(self.inventario)
+
+    def tearDown(self):
+        self.almacen.cerrar()
+        super().tearDown()
+
+    def test_operaciones_core_sobre_sqlite(self):
+        inv = self.almacen.cargar_inventario()
+        agregar_producto(inv, {"codigo": "C3", "nombre": "C", "cantidad": 4, "precio": 2.0}, almacen=self.almacen)
+        vender_producto_logico("a1", 2, 12.0, inv, almacen=self.almacen)
+        eliminar_producto_logico("B2", inv, almacen=self.almacen)
+        inv2 = self.almacen.cargar_inventario()
+        self.assertEqual([(p["codigo"], p["cantidad"]) for p in inv2], [("A1", 3), ("C3", 4)])
+        self.assertEqual(self.almacen.buscar_producto("c3")["nombre"], "C")
+        self.assertEqual(self.almacen.calcular_balance(), (8.0, 24.0))
+        self.assertEqual(self.almacen.totales_por_producto()["A1"], {"VENTA": 24.0})
+
+    def test_migrar_desde_json(self):
+        registrar_transaccion("COMPRA", "A1", "Producto A", 5, 50.0, filename=self.bal_path)
+        self.almacen.guardar_inventario([])
+        migrar_almacenamiento(AlmacenamientoJSON(self.inv_path, self.bal_path), self.almacen)
+        self.assertEqual(len(self.almacen.cargar_inventario()), 2)
+        self.assertEqual(self.almacen.calcular_balance(), (50.0, 0.0))
+
+    def test_venta_y_transaccion_en_una_transaccion(self):
+        inv = self.almacen.cargar_inventario()
+        version = self.almacen.version()
+        # una transacción inválida (sin monto) hace fallar el INSERT después del UPDATE
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.almacen.anexar_lote([{"op": "cantidad", "codigo": "A1", "cantidad": 0}],
+                                     [{"tipo": "VENTA", "codigo": "A1", "monto": None, "ts": 1.0}], inv)
+        self.assertEqual(self.almacen.buscar_producto("A1")["cantidad"], 5)
+        self.assertEqual(self.almacen.version(), version)
+
+    def test_conexion_compartida_entre_hilos(self):
+        import threading
+        inv = self.almacen.cargar_inventario()
+
+        def vender():
+            for _ in range(20):
+                self.almacen.anexar_lote([], [{"tipo": "VENTA", "codigo": "A1", "monto": 1.0, "ts": 1.0}], inv)
+                self.almacen.calcular_balance()
+
+        hilos = [threading.Thread(target=vender) for _ in range(4)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        self.assertEqual(self.almacen.calcular_balance(), (0.0, 80.0))
+        self.assertEqual(len(list(self.almacen.leer_transacciones(lote=7))), 80)
+
+    def test_interfaz_abstracta(self):
+        with self.assertRaises(TypeError):
+            digital_stock.Almacenamiento()
+
+
+class TestInventarioColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.productos = [
+            {"codigo": "A1", "nombre": "Producto A", "cantidad": 5, "precio": 10.0},
+            {"codigo": "B2", "nombre": "Producto B", "cantidad": 20, "precio": 5.0, "umbral": 25},
+            {"codigo": "C3", "nombre": "Producto C", "cantidad": 1, "precio": 2.5, "umbral": 3},
+        ]
+        self.col = InventarioColumnar.desde_lista(self.productos)
+
+    def test_ida_y_vuelta(self):
+        self.assertEqual(self.col.a_lista(), self.productos)
+
+    def test_agregados(self):
+        self.assertEqual(self.col.stock_total(), 26)
+        self.assertEqual(self.col.stock_total(), stock_total_recursivo(self.productos))
+        self.assertAlmostEqual(self.col.valor_total(), 152.5)
+        self.assertEqual(self.col.bajo_stock(10), obtener_productos_bajo_stock(self.productos, 10))
+        self.assertEqual(self.col.bajo_stock(), obtener_productos_bajo_stock(self.productos))
+        self.assertEqual(self.col.bajo_stock(k=1), obtener_productos_bajo_stock(self.productos, k=1))
+        self.assertEqual(self.col.ordenar_filas("valor", descendente=True), [1, 0, 2])
+
+    def test_sin_numpy(self):
+        anterior = digital_stock.np
+        digital_stock.np = None
+        try:
+            self.assertEqual(self.col.stock_total(), 26)
+            self.assertEqual(self.col.filas_bajo_umbral(10), [0, 2])
+            self.assertEqual(self.col.filas_bajo_umbral(2), [2])
+            self.assertEqual(self.col.filas_bajo_umbral(), [0, 1, 2])
+            self.assertEqual(self.col.ordenar_filas("precio"), [2, 1, 0])
+        finally:
+            digital_stock.np = anterior
+
+    def test_quitar_y_ajustar(self):
+        self.col.ajustar_cantidad("b2", 7)
+        self.col.quitar("A1")
+        self.assertEqual([(p["codigo"], p["cantidad"]) for p in self.col.a_lista()], [("B2", 7), ("C3", 1)])
+        self.assertEqual(self.col.fila("c3"), 1)
+        self.assertEqual(self.col.producto(1)["umbral"], 3)
+
+    def test_stock_total_recursivo_catalogo_grande(self):
+        grande = [{"codigo": f"P{i}", "cantidad": 2} for i in range(5000)]
+        self.assertEqual(stock_total_recursivo(grande), 10000)
+
+
+class TestSnapshotBinario(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.bin_path = self.inv_path + ".bin"
+        self.productos = [
+            {"codigo": "A1", "nombre": "Producto A", "cantidad": 5, "precio": 10.0},
+            {"codigo": "b2", "nombre": "Azúcar ñandú", "cantidad": 20, "precio": 5.0, "umbral": 25},
+            {"codigo": "C3", "nombre": "Producto C", "cantidad": 1, "precio": 2.5, "proveedor": "X"},
+        ]
+        guardar_inventario(self.productos, filename=self.inv_path)
+        convertir_snapshot(self.inv_path, self.bin_path)
+
+    def test_busqueda_y_agregados_sin_materializar(self):
+        with SnapshotBinario(self.bin_path) as snapshot:
+            self.assertEqual(len(snapshot), 3)
+            self.assertEqual(snapshot.buscar("B2"), self.productos[1])
+            self.assertEqual(snapshot.buscar("c3")["proveedor"], "X")
+            self.assertIsNone(snapshot.buscar("Z9"))
+            self.assertEqual(snapshot.stock_total(), 26)
+            self.assertAlmostEqual(snapshot.valor_total(), 152.5)
+            self.assertEqual([p["codigo"] for p in snapshot.bajo_stock()], ["C3", "A1", "b2"])
+
+    def test_ida_y_vuelta_con_json(self):
+        self.assertEqual(cargar_inventario(filename=self.bin_path), self.productos)
+        with SnapshotBinario(self.bin_path) as snapshot:
+            self.assertEqual(list(snapshot), self.productos)
+        destino = self.inv_path + ".copia"
+        convertir_snapshot(self.bin_path, destino)
+        self.assertEqual(cargar_inventario(filename=destino), self.productos)
+
+    def test_inventario_persistido_en_binario(self):
+        anterior = digital_stock.FORMATO_SNAPSHOT
+        digital_stock.FORMATO_SNAPSHOT = "binario"
+        try:
+            guardar_inventario(self.productos, filename=self.inv_path)
+        finally:
+            digital_stock.FORMATO_SNAPSHOT = anterior
+        inventario = cargar_inventario(filename=self.inv_path)
+        vender_producto_logico("A1", 2, 12.0, inventario, inventario_file=self.inv_path, balance_file=self.bal_path)
+        self.assertEqual(buscar_producto("A1", cargar_inventario(filename=self.inv_path))["cantidad"], 3)
+        with SnapshotBinario(self.inv_path) as snapshot:
+            self.assertEqual(snapshot.buscar("A1")["cantidad"], 5)  # el log no se aplica
+
+
+class TestIndiceBajoStock(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def test_indice_sigue_ventas_altas_y_bajas(self):
+        inv = cargar_inventario(filename=self.inv_path)
+        self.assertEqual([p["codigo"] for p in obtener_productos_bajo_stock(inv)], ["A1"])
+        vender_producto_logico("B2", 15, 6.0, inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        agregar_producto(inv, {"codigo": "C3", "nombre": "C", "cantidad": 1, "precio": 1.0},
+                         inventario_file=self.inv_path, balance_file=self.bal_path)
+        self.assertEqual([p["codigo"] for p in obtener_productos_bajo_stock(inv)], ["C3", "A1", "B2"])
+        self.assertEqual([p["codigo"] for p in obtener_productos_bajo_stock(inv, k=2)], ["C3", "A1"])
+        eliminar_producto_logico("C3", inv, inventario_file=self.inv_path)
+        self.assertEqual([p["codigo"] for p in obtener_productos_bajo_stock(inv)], ["A1", "B2"])
+        # mismo resultado que el filtrado completo
+        self.assertEqual(obtener_productos_bajo_stock(inv), obtener_productos_bajo_stock(list(inv)))
+
+    def test_umbral_por_producto(self):
+        inv = cargar_inventario(filename=self.inv_path)
+        obtener_productos_bajo_stock(inv)
+        fijar_umbral("A1", 3, inv, inventario_file=self.inv_path)
+        fijar_umbral("B2", 50, inv, inventario_file=self.inv_path)
+        self.assertEqual([p["codigo"] for p in obtener_productos_bajo_stock(inv)], ["B2"])
+        # el umbral se persiste con el producto
+        inv2 = cargar_inventario(filename=self.inv_path)
+        self.assertEqual(buscar_producto("A1", inv2)["umbral"], 3)
+        self.assertEqual([p["codigo"] for p in obtener_productos_bajo_stock(inv2)], ["B2"])
+        # con umbral explícito se ignora el de cada producto
+        self.assertEqual([p["codigo"] for p in obtener_productos_bajo_stock(inv2, umbral=10)], ["A1"])
+
+
+class TestReportesPeriodo(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def _transacciones(self):
+        return [
+            {"tipo": "COMPRA", "codigo": "A1", "nombre": "A", "cantidad": 10, "monto": 100.0, "ts": self._ts("2026-08-30")},
+            {"tipo": "VENTA", "codigo": "A1", "nombre": "A", "cantidad": 2, "monto": 30.0, "ts": self._ts("2026-09-02")},
+            {"tipo": "VENTA", "codigo": "B2", "nombre": "B", "cantidad": 1, "monto": 8.0, "ts": self._ts("2026-09-15")},
+            {"tipo": "VENTA", "codigo": "A1", "nombre": "A", "cantidad": 1, "monto": 15.0, "ts": self._ts("2026-10-01")},
+        ]
+
+    def test_reportes_desde_resumenes(self):
+        almacen = AlmacenamientoJSON(self.inv_path, self.bal_path)
+        almacen.anexar_transacciones(self._transacciones()[:2])
+        self.assertEqual(reporte_periodo("2026-09-01", "2026-09-30", self.bal_path), {"COMPRA": 0.0, "VENTA": 30.0})
+        # las transacciones nuevas se suman sobre los resúmenes guardados
+        almacen.anexar_transacciones(self._transacciones()[2:])
+        self.assertTrue(os.path.exists(self.bal_path + ".resumen"))
+        self.assertEqual(reporte_periodo("2026-09-01", "2026-09-30", self.bal_path), {"COMPRA": 0.0, "VENTA": 38.0})
+        por_producto = reporte_por_producto("2026-08", "2026-10", "a1", self.bal_path)
+        self.assertEqual(list(por_producto), ["A1"])
+        self.assertEqual(por_producto["A1"]["unidades_vendidas"], 3)
+        self.assertEqual(por_producto["A1"]["margen"], -55.0)
+        self.assertEqual(desglose_mensual(self.bal_path),
+                         [("2026-10", 0.0, 15.0), ("2026-09", 0.0, 38.0), ("2026-08", 100.0, 0.0)])
+
+    def test_desglose_sqlite_coincide(self):
+        with AlmacenamientoSQLite(self.inv_path + ".db") as almacen:
+            almacen.anexar_transacciones(self._transacciones())
+            json_almacen = AlmacenamientoJSON(self.inv_path, self.bal_path)
+            json_almacen.anexar_transacciones(self._transacciones())
+            self.assertEqual(almacen.desglose_mensual(2), json_almacen.desglose_mensual(2))
+
+
+def _vender_en_otro_proceso(inv_path, bal_path, veces):
+    inv = cargar_inventario(filename=inv_path)  # copia propia, se vuelve vieja enseguida
+    for _ in range(veces):
+        vender_producto_logico("B2", 1, 6.0, inv, inventario_file=inv_path, balance_file=bal_path)
+
+
+class TestArchivoTransacciones(ArchivosTemporalesMixin, unittest.TestCase):
+    compresion_archivo = "no"
+
+    def setUp(self):
+        super().setUp()
+        self.almacen = AlmacenamientoJSON(self.inv_path, self.bal_path)
+        self.almacen.anexar_transacciones([
+            {"tipo": "COMPRA", "codigo": "A1", "nombre": "A", "cantidad": 10, "monto": 100.0, "ts": self._ts("2024-01-10")},
+            {"tipo": "VENTA", "codigo": "A1", "nombre": "A", "cantidad": 2, "monto": 30.0, "ts": self._ts("2024-01-20")},
+            {"tipo": "VENTA", "codigo": "B2", "nombre": "B", "cantidad": 1, "monto": 8.0, "ts": self._ts("2024-02-03")},
+            {"tipo": "VENTA", "codigo": "A1", "nombre": "A", "cantidad": 1, "monto": 15.0, "ts": self._ts("2024-03-01")},
+        ])
+        self.antes = (calcular_balance(self.bal_path), reporte_por_producto("2024-01", "2024-03", filename=self.bal_path),
+                      desglose_mensual(self.bal_path), list(leer_transacciones(self.bal_path)))
+
+    def _despues(self):
+        return (calcular_balance(self.bal_path), reporte_por_producto("2024-01", "2024-03", filename=self.bal_path),
+                desglose_mensual(self.bal_path), list(leer_transacciones(self.bal_path)))
+
+    def test_archivar_meses_cerrados(self):
+        self.assertEqual(archivar_balance(self.bal_path, antes_de="2024-03", compresion="lzma"), ["2024-01.1", "2024-02.1"])
+        with open(self.bal_path, "r", encoding="utf-8") as f:
+            self.assertEqual(len(f.read().splitlines()), 1)  # sólo marzo sigue abierto
+        self.assertEqual(self._despues(), self.antes)
+        self.assertEqual(reporte_periodo("2024-01-01", "2024-01-31", self.bal_path), {"COMPRA": 100.0, "VENTA": 30.0})
+        self.assertEqual(verificar_archivo(self.bal_path), [])
+
+    def test_archivado_automatico_al_cambiar_de_mes(self):
+        digital_stock.ARCHIVO_COMPRESION = "gzip"
+        registrar_transaccion("VENTA", "A1", "A", 1, 5.0, filename=self.bal_path)
+        with open(self.bal_path, "r", encoding="utf-8") as f:
+            self.assertEqual(len(f.read().splitlines()), 1)
+        compras, ventas = self.antes[0]
+        self.assertEqual(calcular_balance(self.bal_path), (compras, ventas + 5.0))
+        self.assertEqual(len(list(leer_transacciones(self.bal_path))), 5)
+
+    def test_falla_al_archivar_no_falla_la_venta(self):
+        digital_stock.ARCHIVO_COMPRESION = "gzip"
+        inv = cargar_inventario(filename=self.inv_path)
+        archivar = digital_stock.archivar_balance
+        intentos = []
+        def falla(*args, **kwargs):
+            intentos.append(args)
+            raise OSError("disco lleno")
+        digital_stock.archivar_balance = falla
+        try:
+            vender_lote([("B2", 2, 5.0)], inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+            vender_lote([("B2", 1, 5.0)], inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        finally:
+            digital_stock.archivar_balance = archivar
+        self.assertEqual(buscar_producto("B2", inv)["cantidad"], 17)
+        self.assertEqual(len(list(leer_transacciones(self.bal_path))), 6)
+        self.assertEqual(len(intentos), 1)  # no se reintenta en cada anexo
+
+    def test_primera_linea_corrupta_no_dispara_archivado(self):
+        digital_stock.ARCHIVO_COMPRESION = "gzip"
+        with open(self.bal_path, "w", encoding="utf-8") as f:
+            f.write("{corrupta\n" + json.dumps({"tipo": "VENTA", "codigo": "A1", "cantidad": 1, "monto": 5.0}) + "\n")
+        archivar = digital_stock.archivar_balance
+        intentos = []
+        digital_stock.archivar_balance = lambda *args, **kwargs: intentos.append(args)
+        try:
+            for _ in range(3):
+                registrar_transaccion("VENTA", "A1", "A", 1, 5.0, filename=self.bal_path)
+        finally:
+            digital_stock.archivar_balance = archivar
+        self.assertEqual(intentos, [])
+
+    def test_lectores_no_pierden_meses_si_rota_el_diario(self):
+        transacciones = leer_transacciones(self.bal_path)
+        primera = next(transacciones)  # índice y diario ya tomados
+        archivar_balance(self.bal_path, antes_de="2024-03")
+        self.assertEqual([primera] + list(transacciones), self.antes[3])
+        # un tramo planificado sobre el diario viejo no se lee del nuevo
+        tramo = digital_stock._rentabilidad_tramo(self.bal_path, -1, 0, 10 ** 6, None, None)
+        self.assertIsNone(tramo)
+        original = digital_stock._rentabilidad_tramo
+        rotar = [True]
+
+        def rota_una_vez(*args):
+            if rotar.pop() if rotar else False:
+                registrar_transaccion("VENTA", "A1", "A", 1, 5.0, filename=self.bal_path)
+                digital_stock.archivar_balance(self.bal_path)
+            return original(*args)
+
+        digital_stock._rentabilidad_tramo = rota_una_vez
+        try:
+            filas = rentabilidad_por_producto(self.bal_path, trabajadores=1)
+        finally:
+            digital_stock._rentabilidad_tramo = original
+        self.assertEqual(filas["A1"]["ingresos"], 50.0)
+        self.assertEqual(filas["B2"]["ingresos"], 8.0)
+
+    def test_rotacion_cortada_no_duplica(self):
+        terminar = digital_stock._terminar_rotacion
+        digital_stock._terminar_rotacion = lambda filename, indice: None
+        try:
+            archivar_balance(self.bal_path, antes_de="2024-03")
+        finally:
+            digital_stock._terminar_rotacion = terminar
+        # el índice ya confirmó los segmentos pero el diario sigue entero
+        with open(self.bal_path, "r", encoding="utf-8") as f:
+            self.assertEqual(len(f.read().splitlines()), 4)
+        self.assertEqual(self._despues(), self.antes)
+        self.assertEqual(archivar_balance(self.bal_path, antes_de="2024-03"), [])  # completa la rotación pendiente
+        with open(self.bal_path, "r", encoding="utf-8") as f:
+            self.assertEqual(len(f.read().splitlines()), 1)
+        self.assertEqual(self._despues(), self.antes)
+
+    def test_verificar_y_resumir(self):
+        archivar_balance(self.bal_path, antes_de="2024-03")
+        directorio = self.bal_path + ".archivo"
+        os.remove(os.path.join(directorio, "2024-02.1.resumen.json"))
+        with open(os.path.join(directorio, "2024-05.1.jsonl.gz"), "wb") as f:
+            f.write(b"resto de un archivado cortado")
+        self.assertEqual(len(verificar_archivo(self.bal_path)), 2)
+        self.assertEqual(len(verificar_archivo(self.bal_path, reparar=True)), 2)
+        self.assertEqual(verificar_archivo(self.bal_path), [])
+        self.assertEqual(self._despues(), self.antes)
+
+
+class TestRentabilidad(ArchivosTemporalesMixin, unittest.TestCase):
+    compresion_archivo = "no"
+
+    def setUp(self):
+        super().setUp()
+        # ~180 KB de diario: con el tramo mínimo (64 KB) se parte en varios tramos
+        self.transacciones = []
+        for i in range(2000):
+            fecha = f"2024-{1 + i % 3:02d}-{1 + i % 28:02d}"
+            codigo = f"P{i % 7}"
+            self.transacciones.append({"tipo": "COMPRA" if i % 4 == 0 else "VENTA", "codigo": codigo, "nombre": codigo,
+                                       "cantidad": 1 + i % 3, "monto": float(1 + i % 5), "ts": self._ts(fecha)})
+        self.transacciones.append({"tipo": "VENTA", "codigo": "SINCOMPRA", "nombre": "X", "cantidad": 2, "monto": 9.0,
+                                   "ts": self._ts("2024-02-10")})
+        AlmacenamientoJSON(self.inv_path, self.bal_path).anexar_transacciones(self.transacciones)
+
+    def test_tramos_en_paralelo_coinciden_con_una_pasada(self):
+        avances = []
+        serie = rentabilidad_por_producto(self.bal_path, trabajadores=1, costos={"SINCOMPRA": 3.0})
+        paralelo = rentabilidad_por_producto(self.bal_path, trabajadores=2, memoria=2 ** 17, costos={"SINCOMPRA": 3.0},
+                                             progreso=lambda hecho, total: avances.append((hecho, total)))
+        self.assertEqual(paralelo, serie)
+        self.assertGreater(len(avances), 3)
+        self.assertEqual(avances[-1][0], os.path.getsize(self.bal_path))
+        self.assertEqual(sum(f["unidades_vendidas"] for f in serie.values()),
+                         sum(t["cantidad"] for t in self.transacciones if t["tipo"] == "VENTA"))
+        self.assertEqual(serie["SINCOMPRA"]["ganancia"], 3.0)
+        self.assertIsNone(rentabilidad_por_producto(self.bal_path, trabajadores=1)["SINCOMPRA"]["margen"])
+
+    def test_rango_con_meses_archivados(self):
+        esperado = rentabilidad_por_producto(self.bal_path, "2024-01-15", "2024-03-31", trabajadores=1)
+        archivar_balance(self.bal_path, antes_de="2024-03")
+        self.assertEqual(rentabilidad_por_producto(self.bal_path, "2024-01-15", "2024-03-31", trabajadores=2), esperado)
+        with AlmacenamientoSQLite(self.inv_path + ".db") as sqlite:
+            sqlite.anexar_transacciones(self.transacciones)
+            for codigo, fila in sqlite.rentabilidad_por_producto("2024-01-15", "2024-03-31").items():
+                for campo, valor in fila.items():
+                    if valor is None:
+                        self.assertIsNone(esperado[codigo][campo])
+                    else:
+                        self.assertAlmostEqual(valor, esperado[codigo][campo])
+
+
+class TestDemanda(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def test_velocidad_incremental_coincide_con_recalculo(self):
+        inv = cargar_inventario(filename=self.inv_path)
+        for cantidad in (3, 1, 4):
+            vender_producto_logico("B2", cantidad, 5.0, inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        with self.assertRaises(ValueError):
+            vender_lote([("B2", 2, 5.0), ("A1", 99, 1.0)], inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        b2 = buscar_producto("B2", inv)
+        # el log guarda la velocidad y el rollback del lote la deja como estaba
+        recargado = buscar_producto("B2", cargar_inventario(filename=self.inv_path))
+        self.assertAlmostEqual(recargado["velocidad"], b2["velocidad"])
+        self.assertNotIn("velocidad", buscar_producto("A1", inv))
+
+        copia = Inventario(map(dict, inv))
+        self.assertEqual(recalcular_velocidades(copia, leer_transacciones(self.bal_path)), 1)
+        recalculado = buscar_producto("B2", copia)
+        ahora = time.time()
+        self.assertAlmostEqual(digital_stock._velocidad_de(recalculado, ahora), digital_stock._velocidad_de(b2, ahora))
+        self.assertAlmostEqual(b2["velocidad"], 8 / digital_stock.VENTANA_VELOCIDAD_DIAS, places=4)
+
+        with AlmacenamientoSQLite(self.inv_path + ".db") as sqlite:
+            sqlite.guardar_inventario(cargar_inventario(filename=self.inv_path))
+            vender_producto_logico("B2", 1, 5.0, inv, almacen=sqlite)
+            self.assertAlmostEqual(sqlite.buscar_producto("B2")["velocidad"], buscar_producto("B2", inv)["velocidad"])
+            self.assertGreater(buscar_producto("B2", inv)["velocidad"], b2["velocidad"])
+
+    def test_reposicion_por_cobertura(self):
+        ahora = time.time()
+        productos = [
+            # rápido: 15 unidades a 3/día cubren 5 días (< plazo de 7)
+            {"codigo": "RAP", "nombre": "Rapido", "cantidad": 15, "precio": 1.0, "velocidad": 3.0, "venta_ts": ahora},
+            # lento: 5 unidades a 0.1/día cubren 50 días, aunque está bajo el umbral general
+            {"codigo": "LEN", "nombre": "Lento", "cantidad": 5, "precio": 1.0, "velocidad": 0.1, "venta_ts": ahora},
+            # sin ventas registradas: sigue el punto de reposición fijo
+            {"codigo": "NUE", "nombre": "Nuevo", "cantidad": 2, "precio": 1.0},
+            {"codigo": "AGO", "nombre": "Agotado", "cantidad": 0, "precio": 1.0, "velocidad": 1.0, "venta_ts": ahora - 86400},
+        ]
+        inv = Inventario(productos)
+        esperado = ["AGO", "RAP", "NUE"]
+        self.assertEqual([p["codigo"] for p in necesidad_reposicion(inv, ahora=ahora)], esperado)
+        self.assertEqual([p["codigo"] for p in necesidad_reposicion(list(productos), ahora=ahora)], esperado)
+        self.assertAlmostEqual(cobertura_dias(inv.buscar("RAP"), ahora), 5.0)
+        self.assertEqual(cantidad_sugerida(inv.buscar("RAP"), ahora), 3 * 28 - 15)
+        self.assertEqual(cantidad_sugerida(inv.buscar("NUE"), ahora), 8)
+        # el índice de cobertura sigue a las compras sin recorrer el catálogo
+        inv.buscar("RAP")["cantidad"] = 60
+        inv.actualizar(inv.buscar("RAP"))
+        self.assertEqual([p["codigo"] for p in necesidad_reposicion(inv, ahora=ahora)], ["AGO", "NUE"])
+        # con el paso del tiempo la demanda del lento decae y su cobertura crece
+        self.assertGreater(cobertura_dias(inv.buscar("LEN"), ahora + 30 * 86400), 50.0)
+
+
+class TestProducto(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def test_se_usa_como_dict(self):
+        p = Producto("X1", "Equis", 3, 19.99, umbral=2)
+        self.assertEqual(p, {"codigo": "X1", "nombre": "Equis", "cantidad": 3, "precio": 19.99, "umbral": 2})
+        self.assertEqual(p._centavos, 1999)
+        self.assertEqual(p.get("umbral"), 2)
+        self.assertIsNone(p.get("velocidad"))
+        p["precio"] = 1.234  # se guarda al centavo
+        p["velocidad"] = 0.5
+        p.pop("umbral")
+        self.assertEqual(list(p), ["codigo", "nombre", "cantidad", "precio", "velocidad"])
+        self.assertEqual(dict(p, deposito="d"), {"codigo": "X1", "nombre": "Equis", "cantidad": 3, "precio": 1.23,
+                                                 "velocidad": 0.5, "deposito": "d"})
+        with self.assertRaises(TypeError):
+            del p["codigo"]
+        copia = p.copy()
+        copia["cantidad"] = 9
+        self.assertEqual(p["cantidad"], 3)
+        # registros viejos que no encajan quedan como dict
+        self.assertEqual(Producto.desde_dict({"codigo": "V", "precio": None}), {"codigo": "V", "precio": None})
+        self.assertIsInstance(Producto.desde_dict({"codigo": "V"}), Producto)
+
+    def test_ida_y_vuelta_json_y_log(self):
+        inv = cargar_inventario(filename=self.inv_path)
+        self.assertTrue(all(isinstance(p, Producto) for p in inv))
+        self.assertEqual(inv, self.inventario)
+        agregar_producto(inv, {"codigo": "C3", "nombre": "Producto C", "cantidad": 10, "precio": 2.5},
+                         inventario_file=self.inv_path, balance_file=self.bal_path)
+        fijar_umbral("A1", 3, inv, inventario_file=self.inv_path)
+        recargado = cargar_inventario(filename=self.inv_path)
+        self.assertEqual(recargado, inv)
+        self.assertIsInstance(recargado.buscar("C3"), Producto)
+        self.assertEqual(recargado.buscar("A1")["umbral"], 3)
+        guardar_inventario(recargado, filename=self.inv_path)
+        with open(self.inv_path, "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f), [dict(p) for p in inv])
+        with AlmacenamientoSQLite(self.inv_path + ".db") as sqlite:
+            sqlite.guardar_inventario(recargado)
+            self.assertEqual(sqlite.cargar_inventario(), inv)
+
+    def test_alta_en_sesion_queda_igual_que_al_recargar(self):
+        inv = cargar_inventario(filename=self.inv_path)
+        nuevo = agregar_producto(inv, {"codigo": "C3", "nombre": "C", "cantidad": 3, "precio": 1.234},
+                                 inventario_file=self.inv_path, balance_file=self.bal_path)
+        self.assertIsInstance(nuevo, Producto)
+        self.assertIs(inv.buscar("C3"), nuevo)
+        self.assertEqual(nuevo["precio"], 1.23)
+        self.assertEqual(cargar_inventario(filename=self.inv_path).buscar("C3"), nuevo)
+        self.assertAlmostEqual(list(leer_transacciones(self.bal_path))[-1]["monto"], 3 * 1.23)
+        # la velocidad de venta va en slots, no en el dict de extras
+        vender_producto_logico("C3", 1, 2.0, inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        self.assertIsNone(nuevo._extra)
+        self.assertIn("velocidad", nuevo)
+
+
+class TestDepositos(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.depositos = AlmacenDepositos(self.directorio, tipo="json", paralelo="hilos")
+        for nombre, cantidades in (("norte", (5, 30)), ("sur", (2, 8))):
+            self.depositos.crear_deposito(nombre)
+            for codigo, cantidad in zip(("A1", "B2"), cantidades):
+                self.depositos.agregar_producto({"codigo": codigo, "nombre": f"Producto {codigo}",
+                                                 "cantidad": cantidad, "precio": 1.0}, nombre)
+
+    def tearDown(self):
+        self.depositos.cerrar()
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def test_ruteo_por_deposito(self):
+        self.assertEqual(self.depositos.nombres(), ["norte", "sur"])
+        self.depositos.vender("a1", 3, 4.0, "norte")
+        self.assertEqual(self.depositos.buscar_producto("A1", "norte")["cantidad"], 2)
+        self.assertEqual(self.depositos.buscar_producto("A1", "sur")["cantidad"], 2)
+        inventario_norte = cargar_inventario(os.path.join(self.directorio, "norte", digital_stock.INVENTARIO_FILE))
+        self.assertEqual(buscar_producto("A1", inventario_norte)["cantidad"], 2)
+        with self.assertRaises(ValueError):
+            self.depositos.vender("A1", 1, 1.0, "oeste")
+
+    def test_mismo_deposito_con_espacios(self):
+        self.assertIs(self.depositos.inventario(" norte "), self.depositos.inventario("norte"))
+        self.depositos.vender("A1", 1, 1.0, " norte")
+        self.depositos.vender("B2", 1, 1.0, "norte")
+        inventario_norte = cargar_inventario(os.path.join(self.directorio, "norte", digital_stock.INVENTARIO_FILE))
+        self.assertEqual([(p["codigo"], p["cantidad"]) for p in inventario_norte], [("A1", 4), ("B2", 29)])
+
+    def test_consultas_globales_en_paralelo(self):
+        self.depositos.vender("B2", 1, 10.0, "sur")
+        esperado = (self.depositos.stock_total(), self.depositos.calcular_balance(),
+                    self.depositos.obtener_productos_bajo_stock(), self.depositos.resumen())
+        self.assertEqual(esperado[0], 44)
+        self.assertEqual(esperado[1], (45.0, 10.0))
+        self.assertEqual([(p["deposito"], p["codigo"], p["cantidad"]) for p in esperado[2]],
+                         [("sur", "A1", 2), ("norte", "A1", 5), ("sur", "B2", 7)])
+        self.assertEqual(esperado[3]["depositos"]["sur"], {"stock": 9, "compras": 10.0, "ventas": 10.0})
+        with AlmacenDepositos(self.directorio, tipo="json", paralelo="procesos", trabajadores=2) as procesos:
+            self.assertEqual((procesos.stock_total(), procesos.calcular_balance(),
+                              procesos.obtener_productos_bajo_stock(), procesos.resumen()), esperado)
+
+    def test_deposito_se_crea_solo_explicitamente(self):
+        import contextlib
+        import io
+        from unittest import mock
+        with mock.patch.object(digital_stock, "DEPOSITOS_DIR", self.directorio), \
+                contextlib.redirect_stderr(io.StringIO()), contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                digital_stock.main(["--deposito", "nrote", "reporte"])
+            self.assertFalse(os.path.exists(os.path.join(self.directorio, "nrote")))
+            self.assertEqual(digital_stock.main(["depositos", "crear", "este"]), 0)
+            self.assertEqual(digital_stock.main(["--deposito", "este", "reporte"]), 0)
+        self.assertEqual(self.depositos.nombres(), ["este", "norte", "sur"])
+        # nombres y resultados salen de la misma lectura del directorio
+        nombres, partes = self.depositos._repartir("stock")
+        self.assertEqual(dict(zip(nombres, partes)), {"este": 0, "norte": 35, "sur": 10})
+
+
+class TestConcurrencia(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def test_sesion_vieja_recarga_en_lugar_de_pisar(self):
+        sesion_a = cargar_inventario(filename=self.inv_path)
+        sesion_b = cargar_inventario(filename=self.inv_path)
+        recargas = METRICAS_CONCURRENCIA["recargas"]
+        vender_producto_logico("B2", 2, 6.0, sesion_a, inventario_file=self.inv_path, balance_file=self.bal_path)
+        vender_producto_logico("B2", 3, 6.0, sesion_b, inventario_file=self.inv_path, balance_file=self.bal_path)
+        self.assertEqual(METRICAS_CONCURRENCIA["recargas"], recargas + 1)
+        self.assertEqual(buscar_producto("B2", sesion_b)["cantidad"], 15)
+        # al guardar todo (como al salir del menú) la sesión vieja también se pone al día
+        with AlmacenamientoJSON(self.inv_path, self.bal_path).bloquear(sesion_a):
+            guardar_inventario(sesion_a, self.inv_path)
+        self.assertEqual(buscar_producto("B2", cargar_inventario(filename=self.inv_path))["cantidad"], 15)
+
+    @unittest.skipUnless(digital_stock.fcntl, "requiere fcntl")
+    def test_ventas_desde_varios_procesos(self):
+        import multiprocessing
+        procesos = [multiprocessing.Process(target=_vender_en_otro_proceso, args=(self.inv_path, self.bal_path, 5))
+                    for _ in range(4)]
+        for p in procesos:
+            p.start()
+        for p in procesos:
+            p.join()
+        self.assertEqual(buscar_producto("B2", cargar_inventario(filename=self.inv_path))["cantidad"], 0)
+        self.assertEqual(calcular_balance(filename=self.bal_path), (0.0, 120.0))
+
+    def test_sesion_carga_en_segundo_plano(self):
+        almacen = AlmacenamientoJSON(self.inv_path, self.bal_path)
+        sesion = digital_stock.SesionLocal(almacen, en_segundo_plano=True)
+        sesion.vender_producto_logico("A1", 2, 12.0)  # espera a que termine la carga
+        self.assertFalse(sesion.cargando)
+        self.assertEqual(sesion.buscar_producto("A1")["cantidad"], 3)
+        self.assertEqual(sesion.calcular_balance(), (0.0, 24.0))
+
+
+class TestServicio(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        import asyncio
+        import threading
+        self.direccion = "unix:" + self.inv_path + ".sock"
+        self.servicio = ServicioStock(AlmacenamientoJSON(self.inv_path, self.bal_path), espera_ms=20,
+                                      max_pedido_bytes=2 ** 16)
+        self.loop = asyncio.new_event_loop()
+        listo = threading.Event()
+
+        def correr():
+            asyncio.set_event_loop(self.loop)
+            self.tarea = self.loop.create_task(self.servicio.servir(self.direccion))
+            self.loop.call_soon(listo.set)
+            try:
+                self.loop.run_until_complete(self.tarea)
+            except asyncio.CancelledError:
+                pass
+
+        self.hilo = threading.Thread(target=correr, daemon=True)
+        self.hilo.start()
+        listo.wait()
+        while not os.path.exists(self.direccion[len("unix:"):]):
+            time.sleep(0.005)
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.tarea.cancel)
+        self.hilo.join()
+        self.loop.close()
+        super().tearDown()
+
+    def test_operaciones_basicas(self):
+        cliente = ClienteStock(self.direccion)
+        try:
+            cliente.agregar_producto({"codigo": "C3", "nombre": "C", "cantidad": 4, "precio": 2.0})
+            cliente.vender_producto_logico("a1", 2, 12.0)
+            self.assertEqual(cliente.buscar_producto("A1")["cantidad"], 3)
+            with self.assertRaises(ValueError):
+                cliente.vender_producto_logico("A1", 99, 12.0)
+            self.assertEqual(cliente.eliminar_producto_logico("B2")["codigo"], "B2")
+            self.assertEqual(cliente.calcular_balance(), (8.0, 24.0))
+            self.assertEqual([p["codigo"] for p in cliente.listar_inventario()], ["A1", "C3"])
+        finally:
+            cliente.cerrar()
+        # lo confirmado ya está en disco
+        inv = cargar_inventario(filename=self.inv_path)
+        self.assertEqual([(p["codigo"], p["cantidad"]) for p in inv], [("A1", 3), ("C3", 4)])
+
+    def test_pedido_demasiado_grande(self):
+        cliente = ClienteStock(self.direccion)
+        try:
+            with self.assertRaisesRegex(ValueError, "demasiado grande"):
+                cliente.vender_lote([("B2", 1, 5.0)] * 20000)
+            # la conexión sigue y el pedido siguiente se lee entero
+            self.assertEqual(len(cliente.vender_lote([("B2", 1, 5.0)] * 2)), 2)
+            self.assertEqual(cliente.buscar_producto("B2")["cantidad"], 18)
+        finally:
+            cliente.cerrar()
+
+    def test_commit_de_grupo_con_muchas_cajas(self):
+        import threading
+
+        def caja():
+            cliente = ClienteStock(self.direccion)
+            try:
+                for _ in range(5):
+                    cliente.vender_producto_logico("B2", 1, 6.0)
+            finally:
+                cliente.cerrar()
+
+        cajas = [threading.Thread(target=caja) for _ in range(4)]
+        for c in cajas:
+            c.start()
+        for c in cajas:
+            c.join()
+        self.assertEqual(buscar_producto("B2", cargar_inventario(filename=self.inv_path))["cantidad"], 0)
+        self.assertEqual(calcular_balance(filename=self.bal_path), (0.0, 120.0))
+        self.assertLess(self.servicio.metricas["commits"], 20)
+
+    def test_no_pisa_el_socket_de_un_servicio_vivo(self):
+        import asyncio
+        import servicio
+        otro = ServicioStock(AlmacenamientoJSON(self.inv_path, self.bal_path))
+        with self.assertRaises(OSError):
+            asyncio.run(otro.servir(self.direccion))
+        # el servicio original sigue atendiendo
+        cliente = ClienteStock(self.direccion)
+        try:
+            self.assertEqual(cliente.buscar_producto("A1")["cantidad"], 5)
+        finally:
+            cliente.cerrar()
+        # un socket abandonado sí se reemplaza
+        import socket
+        viejo = self.inv_path + ".viejo.sock"
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(viejo)
+        s.close()
+        servicio._quitar_socket_viejo(viejo)
+        self.assertFalse(os.path.exists(viejo))
+
+    def test_rentabilidad_sin_pool_de_procesos(self):
+        import threading
+        from unittest import mock
+        almacen = self.servicio.almacen
+        hilos = []
+        original = almacen.rentabilidad_por_producto
+
+        def espia(*args, **kwargs):
+            hilos.append(threading.current_thread().name)
+            return original(*args, **kwargs)
+
+        cliente = ClienteStock(self.direccion)
+        try:
+            cliente.vender_producto_logico("A1", 2, 12.0)
+            with mock.patch.object(almacen, "rentabilidad_por_producto", side_effect=espia) as llamada:
+                filas = cliente.rentabilidad_por_producto()
+        finally:
+            cliente.cerrar()
+        self.assertEqual(filas["A1"]["ingresos"], 24.0)
+        self.assertEqual(llamada.call_args.kwargs["trabajadores"], 1)
+        self.assertNotEqual(hilos, [self.hilo.name])  # fuera del hilo del loop
+
+    def test_falla_de_transacciones_revierte_el_grupo(self):
+        from unittest import mock
+        almacen = self.servicio.almacen
+        cliente = ClienteStock(self.direccion)
+        try:
+            cliente.fijar_umbral("B2", 3)
+            with mock.patch.object(almacen, "anexar_transacciones", side_effect=OSError("disco lleno")):
+                with self.assertRaises(ValueError):
+                    cliente.vender_producto_logico("A1", 2, 12.0)
+            # el servicio recargó lo que quedó en disco: la venta no figura
+            self.assertEqual(cliente.buscar_producto("A1")["cantidad"], 5)
+        finally:
+            cliente.cerrar()
+        inv = cargar_inventario(filename=self.inv_path)
+        self.assertEqual([(p["codigo"], p["cantidad"]) for p in inv], [("A1", 5), ("B2", 20)])
+        self.assertEqual(buscar_producto("B2", inv)["umbral"], 3)
+        self.assertEqual(calcular_balance(filename=self.bal_path), (0.0, 0.0))
+
+    def test_falla_al_recargar_igual_responde_a_los_clientes(self):
+        from unittest import mock
+        almacen = self.servicio.almacen
+        cliente = ClienteStock(self.direccion)
+        try:
+            with mock.patch.object(almacen, "anexar_transacciones", side_effect=OSError("disco lleno")), \
+                    mock.patch.object(almacen, "cargar_inventario", side_effect=OSError("disco lleno")):
+                with self.assertRaises(ValueError):
+                    cliente.vender_producto_logico("A1", 1, 12.0)
+        finally:
+            cliente.cerrar()
+
+
+class TestCacheLecturas(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def test_carga_repetida_usa_cache_y_escritura_invalida(self):
+        cache = digital_stock.CACHE_LECTURAS
+        primera = cargar_inventario(filename=self.inv_path)
+        aciertos = cache.aciertos
+        segunda = cargar_inventario(filename=self.inv_path)
+        self.assertEqual(cache.aciertos, aciertos + 1)
+        self.assertEqual(segunda, primera)
+        # la copia es independiente: modificarla no toca la caché
+        segunda[0]["cantidad"] = 999
+        self.assertEqual(cargar_inventario(filename=self.inv_path)[0]["cantidad"], 5)
+        vender_producto_logico("A1", 2, 12.0, primera, inventario_file=self.inv_path, balance_file=self.bal_path)
+        self.assertEqual(cargar_inventario(filename=self.inv_path)[0]["cantidad"], 3)
+        self.assertEqual(calcular_balance(filename=self.bal_path), (0.0, 24.0))
+        registrar_transaccion("VENTA", "A1", "A", 1, 6.0, filename=self.bal_path)
+        self.assertEqual(calcular_balance(filename=self.bal_path), (0.0, 30.0))
+
+    def test_lru_acotada(self):
+        cache = digital_stock.CacheArchivos(maximo=2)
+        cache.guardar("t", "a", (1,), "A")
+        cache.guardar("t", "b", (1,), "B")
+        self.assertEqual(cache.obtener("t", "a", (1,)), "A")  # "a" pasa a ser la más reciente
+        cache.guardar("t", "c", (1,), "C")
+        self.assertIsNone(cache.obtener("t", "b", (1,)))
+        self.assertEqual(cache.obtener("t", "a", (1,)), "A")
+        self.assertIsNone(cache.obtener("t", "a", (2,)))  # cambió la firma del archivo
+
+    def test_acotada_en_bytes(self):
+        cache = digital_stock.CacheArchivos(maximo=16, maximo_bytes=100)
+        cache.guardar("t", "a", (1,), "A", peso=60)
+        cache.guardar("t", "b", (1,), "B", peso=30)
+        cache.guardar("t", "c", (1,), "C", peso=30)  # desaloja "a"
+        self.assertIsNone(cache.obtener("t", "a", (1,)))
+        self.assertEqual(cache.bytes, 60)
+        cache.guardar("t", "d", (1,), "D", peso=101)  # más grande que todo el presupuesto
+        self.assertIsNone(cache.obtener("t", "d", (1,)))
+        cache.invalidar("b")
+        self.assertEqual(cache.bytes, 30)
+        # un inventario que no entra se lee igual, sin guardarse
+        original = digital_stock.CACHE_LECTURAS
+        digital_stock.CACHE_LECTURAS = digital_stock.CacheArchivos(maximo=16, maximo_bytes=10)
+        try:
+            self.assertEqual(len(cargar_inventario(filename=self.inv_path)), 2)
+            self.assertEqual(len(digital_stock.CACHE_LECTURAS), 0)
+        finally:
+            digital_stock.CACHE_LECTURAS = original
+
+
+class TestInstrumentacion(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def tearDown(self):
+        digital_stock.desactivar_instrumentacion()
+        digital_stock.reiniciar_metricas()
+        super().tearDown()
+
+    def test_mide_llamadas_y_es(self):
+        original = digital_stock.buscar_producto
+        digital_stock.reiniciar_metricas()
+        digital_stock.activar_instrumentacion()
+        inv = digital_stock.cargar_inventario(self.inv_path)
+        digital_stock.vender_producto_logico("A1", 1, 12.0, inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        resumen = digital_stock.resumen_instrumentacion()
+        self.assertEqual(resumen["operaciones"]["cargar_inventario"]["llamadas"], 1)
+        self.assertEqual(resumen["operaciones"]["buscar_producto"]["llamadas"], 1)
+        self.assertEqual(sum(resumen["operaciones"]["vender_producto_logico"]["histograma"].values()), 1)
+        self.assertGreater(resumen["io"]["aperturas"], 0)
+        self.assertGreater(resumen["io"]["bytes_leidos"], 0)
+        self.assertGreater(resumen["io"]["bytes_escritos"], 0)
+        # desactivada vuelven las funciones originales, sin envoltura
+        digital_stock.desactivar_instrumentacion()
+        self.assertIs(digital_stock.buscar_producto, original)
+        self.assertNotIn("open", vars(digital_stock))
+
+
+class TestImportacionExportacion(ArchivosTemporalesMixin, unittest.TestCase):
+
+    def test_importar_csv_saltea_invalidos_y_duplicados(self):
+        csv_path = self.inv_path + ".csv"
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("codigo,nombre,cantidad,precio\n"
+                    "C3,Producto C,4,2.5\n"
+                    "a1,Repetido,1,1\n"
+                    "c3,Repetido en el archivo,1,1\n"
+                    "mal código,X,1,1\n"
+                    "D4,Producto D,0,1\n"
+                    "E5,Producto E,2,abc\n")
+        inv = cargar_inventario(filename=self.inv_path)
+        resumen = importar_productos(leer_registros(csv_path), inv, inventario_file=self.inv_path, balance_file=self.bal_path)
+        self.assertEqual((resumen["importados"], resumen["duplicados"], resumen["invalidos"]), (1, 2, 3))
+        self.assertTrue(resumen["errores"][0].startswith("Línea 5:"))
+        self.assertEqual(len(cargar_inventario(filename=self.inv_path)), 3)
+        self.assertEqual(calcular_balance(filename=self.bal_path), (10.0, 0.0))
+
+    def test_exportar_e_importar_jsonl(self):
+        almacen = AlmacenamientoJSON(self.inv_path, self.bal_path)
+        vender_producto_logico("B2", 2, 6.0, almacen.cargar_inventario(), almacen=almacen)
+        destino = self.inv_path + ".jsonl"
+        self.assertEqual(exportar_productos(destino, almacen.cargar_inventario()), 2)
+        otro = Inventario()
+        resumen = importar_productos(leer_registros(destino), otro, inventario_file=self.inv_path + ".otro",
+                                     balance_file=self.bal_path + ".otro")
+        self.assertEqual(resumen["importados"], 2)
+        self.assertEqual(buscar_producto("B2", otro)["cantidad"], 18)
+        self.assertEqual(exportar_transacciones(self.bal_path + ".csv", almacen), 1)
+        with open(self.bal_path + ".csv", encoding="utf-8") as f:
+            self.assertEqual(f.readline().strip(), "tipo,codigo,nombre,cantidad,monto,ts")
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_generador_determinista(self):
+        import benchmark
+        primero = list(benchmark.generar_transacciones(50, 10, semilla=3))
+        self.assertEqual(primero, list(benchmark.generar_transacciones(50, 10, semilla=3)))
+        self.assertEqual(len({p["codigo"] for p in benchmark.generar_inventario(100)}), 100)
+
+    def test_comparar_con_linea_base(self):
+        import benchmark
+        base = {"tamanos": {"chico": {"operaciones": {"buscar": 0.010, "balance": 0.010}}}}
+        actual = {"tamanos": {"chico": {"operaciones": {"buscar": 0.011, "balance": 0.020, "nueva": 1.0}}}}
+        regresiones = benchmark.comparar(actual, base, tolerancia=0.25)
+        self.assertEqual(len(regresiones), 1)
+        self.assertTrue(regresiones[0].startswith("chico/balance"))
+
+
+class TestInventarioIndexado(unittest.TestCase):
+
+    def setUp(self):
+        self.inv = Inventario([
+            {"codigo": "A1", "nombre": "Producto A", "cantidad": 5, "precio": 10.0},
+            {"codigo": "B2", "nombre": "Producto B", "cantidad": 20, "precio": 5.0},
+        ])
+
+    def test_busqueda_case_insensitive(self):
+        self.assertIs(buscar_producto("a1", self.inv), self.inv[0])
+        self.assertIs(self.inv.buscar("B2"), self.inv[1])
+        self.assertIsNone(self.inv.buscar("Z9"))
+
+    def test_altas_y_bajas_mantienen_indice(self):
+        self.inv.append({"codigo": "C3", "nombre": "C", "cantidad": 1, "precio": 1.0})
+        self.assertIsNotNone(self.inv.buscar("c3"))
+        quitado = self.inv.quitar("A1")
+        self.assertEqual(quitado["codigo"], "A1")
+        self.assertIsNone(self.inv.buscar("a1"))
+        # quitar conserva el orden de alta
+        self.assertEqual([p["codigo"] for p in self.inv], ["B2", "C3"])
+        self.inv.pop(0)
+        self.assertIsNone(self.inv.buscar("B2"))
+        self.assertEqual(self.inv.quitar("C3")["codigo"], "C3")
+        self.assertEqual(list(self.inv), [])
+
+    def test_quitar_conserva_el_orden(self):
+        import random
+        inv = Inventario({"codigo": f"P{i}", "nombre": "x", "cantidad": i, "precio": 1.0} for i in range(300))
+        esperado = [p["codigo"] for p in inv]
+        azar = random.Random(3)
+        for n in range(250):
+            if n % 7 == 0:  # altas intercaladas: ranuras nuevas y rearmado al agotar la capacidad
+                codigo = f"N{n}"
+                inv.append({"codigo": codigo, "nombre": "x", "cantidad": 1, "precio": 1.0})
+                esperado.append(codigo)
+            codigo = azar.choice(esperado)
+            inv.quitar(codigo)
+            esperado.remove(codigo)
+            self.assertIsNone(inv.buscar(codigo))
+        self.assertEqual([p["codigo"] for p in inv], esperado)
+
+    def test_quitar_por_identidad(self):
+        igual = dict(self.inv[0])
+        self.inv.append({"codigo": "C3", "nombre": "C", "cantidad": 1, "precio": 1.0})
+        self.inv.remove(self.inv.buscar("B2"))
+        self.assertEqual([p["codigo"] for p in self.inv], ["A1", "C3"])
+        self.inv.remove(igual)  # sin el mismo objeto, como list.remove: el primero igual
+        self.assertEqual([p["codigo"] for p in self.inv], ["C3"])
+        with self.assertRaises(ValueError):
+            self.inv.remove(igual)
+
+    def test_se_serializa_como_lista(self):
+        self.assertIsInstance(self.inv, list)
+        self.assertEqual(json.loads(json.dumps(self.inv)), list(self.inv))
+
+    def test_recursivo_sin_limite_de_recursion(self):
+        grande = [{"codigo": f"P{i}", "nombre": "x", "cantidad": 1, "precio": 1.0} for i in range(5000)]
+        self.assertEqual(buscar_producto_recursivo("p4999", grande)["codigo"], "P4999")
+        self.assertIsNone(buscar_producto_recursivo("NOPE", grande))
+
+    def test_busqueda_por_nombre(self):
+        self.inv.extend([
+            {"codigo": "T8", "nombre": "Tornillo 8mm acero", "cantidad": 100, "precio": 0.5},
+            {"codigo": "T10", "nombre": "Tornillo 10mm", "cantidad": 50, "precio": 0.6},
+            {"codigo": "C1", "nombre": "Cañería PVC", "cantidad": 3, "precio": 9.0},
+        ])
+        self.assertEqual([p["codigo"] for p in self.inv.buscar_por_nombre("tornillo 8")], ["T8"])
+        self.assertEqual([p["codigo"] for p in self.inv.buscar_por_nombre("torn")], ["T10", "T8"])
+        self.assertEqual([p["codigo"] for p in self.inv.buscar_por_nombre("tornilo 8mm")], ["T8"])  # error de tipeo
+        self.assertEqual([p["codigo"] for p in self.inv.buscar_por_nombre("caneria")], ["C1"])  # sin acentos
+        self.assertEqual(self.inv.buscar_por_nombre("martillo"), [])
+        # el índice se mantiene con altas, bajas y cambios de nombre
+        self.inv.append({"codigo": "T6", "nombre": "Tornillo 6mm", "cantidad": 1, "precio": 0.4})
+        self.inv.quitar("T10")
+        self.assertEqual([p["codigo"] for p in self.inv.buscar_por_nombre("tornillo")], ["T6", "T8"])
+        digital_stock._aplicar_cambio(self.inv, {"op": "alta", "producto": {
+            "codigo": "T6", "nombre": "Tarugo 6mm", "cantidad": 1, "precio": 0.4}})
+        self.assertEqual([p["codigo"] for p in self.inv.buscar_por_nombre("tarugo")], ["T6"])
+        self.assertEqual([p["codigo"] for p in self.inv.buscar_por_nombre("tornillo")], ["T8"])
+
+    def test_orden_por_nombre_cacheado(self):
+        productos, _ = self.inv.ordenado_por_nombre()
+        self.inv[0]["cantidad"] = 1
+        self.inv.actualizar(self.inv[0])
+        self.assertIs(self.inv.ordenado_por_nombre()[0], productos)
+        self.inv.append({"codigo": "C3", "nombre": "Aceite", "cantidad": 1, "precio": 1.0})
+        productos, _ = self.inv.ordenado_por_nombre()
+        self.assertEqual([p["codigo"] for p in productos], ["C3", "A1", "B2"])
+        self.assertEqual(digital_stock.posicion_por_nombre("b2", self.inv), 2)
+        self.assertIsNone(digital_stock.posicion_por_nombre("Z9", self.inv))
+
+
 if __name__ == "__main__":
     unittest.main()